@@ -0,0 +1,101 @@
+# Copyright 2023, Nice Guy IT, LLC. All rights reserved.
+# SPDX-License-Identifier: MIT
+# Source: https://github.com/NiceGuyIT/pimp-my-tactical
+
+"""
+exec-wrapper-startup will benchmark the import time of each startup phase of all-exec-wrapper.py. Every phase is run
+in a new interpreter, using the interpreter running this benchmark, so run it with both CPython and RustPython:
+  python3 bench/exec-wrapper-startup.py
+  /opt/exec-wrapper/bin/rustpython bench/exec-wrapper-startup.py
+
+Phases:
+- interpreter: Start the interpreter and do nothing. This is the baseline.
+- wrapper module: Load all-exec-wrapper.py without running main(). This is the stdlib imports of the wrapper.
+- import urllib.request: Import the stdlib HTTP client (WRAPPER_HTTP_CLIENT=urllib).
+- import requests: Import the requests HTTP client (WRAPPER_HTTP_CLIENT=requests). Skipped if not installed.
+- import concurrent.futures: Import the thread pool used to download the binary and script at the same time.
+
+Environmental variables
+- BENCH_RUNS is the number of runs for each phase. The median is reported.
+  Default: 5
+"""
+import os
+import subprocess
+import sys
+
+"""
+wrapper_file is the full path to all-exec-wrapper.py.
+"""
+wrapper_file = os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "scripts",
+                                             "all-exec-wrapper.py"))
+
+"""
+phases maps the phase name to the code that is timed in a new interpreter.
+"""
+phases = {
+    "interpreter": "pass",
+    "wrapper module": f"import runpy; runpy.run_path({wrapper_file!r}, run_name='bench')",
+    "import urllib.request": "import urllib.request",
+    "import requests": "import requests",
+    "import concurrent.futures": "import concurrent.futures",
+}
+
+"""
+timer_code wraps the phase code to print the seconds it took.
+"""
+timer_code = "import time\nstart = time.perf_counter()\n{code}\nprint(time.perf_counter() - start)\n"
+
+
+def run_phase(code: str) -> tuple:
+    """
+    run_phase will run the code in a new interpreter and return the time to import the code and the total wall time.
+    :param code: Python code to run.
+    :type code: str
+    :return: (import seconds, wall seconds), or None if the code failed.
+    :rtype: tuple
+    """
+    import time
+    start = time.perf_counter()
+    result = subprocess.run([sys.executable, "-c", timer_code.format(code=code)], stdout=subprocess.PIPE,
+                            stderr=subprocess.PIPE, universal_newlines=True)
+    wall = time.perf_counter() - start
+    if result.returncode != 0:
+        return None
+    return float(result.stdout.strip().splitlines()[-1]), wall
+
+
+def median(values: list) -> float:
+    """
+    median will return the median of the values.
+    :param values: List of numbers.
+    :type values: list
+    :return: The median.
+    :rtype: float
+    """
+    values = sorted(values)
+    middle = len(values) // 2
+    if len(values) % 2 == 1:
+        return values[middle]
+    return (values[middle - 1] + values[middle]) / 2
+
+
+def main():
+    """
+    Run each phase BENCH_RUNS times and print the median import and wall time.
+    """
+    runs = int(os.getenv("BENCH_RUNS", "5"))
+    print(f"Interpreter: {sys.executable} ({sys.implementation.name} {sys.version.split()[0]})")
+    print(f"Runs per phase: {runs}")
+    print(f'{"phase":<28}{"import (ms)":>14}{"wall (ms)":>14}')
+    for (name, code) in phases.items():
+        results = [run_phase(code) for _ in range(runs)]
+        if None in results:
+            print(f'{name:<28}{"failed":>14}{"":>14}')
+            continue
+        import_ms = median([result[0] for result in results]) * 1000
+        wall_ms = median([result[1] for result in results]) * 1000
+        print(f"{name:<28}{import_ms:>14.1f}{wall_ms:>14.1f}")
+
+
+if __name__ == "__main__":
+    main()
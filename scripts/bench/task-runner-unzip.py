@@ -0,0 +1,150 @@
+# Copyright 2023, Nice Guy IT, LLC. All rights reserved.
+# SPDX-License-Identifier: MIT
+# Source: https://github.com/NiceGuyIT/pimp-my-tactical
+
+"""
+task-runner-unzip will benchmark the ZIP extraction of all-task-runner.py against zipfile.ZipFile.extractall() on a
+synthetic archive with many members. The archive is created in a temporary directory and removed afterward.
+  python3 bench/task-runner-unzip.py
+
+Extractors:
+- extractall: zipfile.ZipFile.extractall() on a single thread. This is the baseline.
+- Decompress N threads: Decompress.extract_to() with RUNNER_EXTRACT_WORKERS=N.
+
+Environmental variables
+- BENCH_RUNS is the number of runs for each extractor. The median is reported.
+  Default: 3
+- BENCH_MEMBERS is the number of files in the synthetic archive.
+  Default: 2000
+- BENCH_MEMBER_KB is the size of each file in KB before compression.
+  Default: 64
+"""
+import importlib.util
+import logging
+import os
+import random
+import shutil
+import tempfile
+import time
+import zipfile
+
+"""
+runner_file is the full path to all-task-runner.py.
+"""
+runner_file = os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "scripts",
+                                            "all-task-runner.py"))
+
+
+def load_runner():
+    """
+    load_runner will load all-task-runner.py as a module without running main().
+    :return: The all-task-runner module.
+    :rtype: module
+    """
+    spec = importlib.util.spec_from_file_location("all_task_runner", runner_file)
+    runner = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(runner)
+    runner.logger = logging.getLogger()
+    return runner
+
+
+def create_archive(archive: str, members: int, member_kb: int):
+    """
+    create_archive will create a ZIP archive with compressible files spread over a few directories.
+    :param archive: Full path to the archive to create.
+    :type archive: str
+    :param members: Number of files in the archive.
+    :type members: int
+    :param member_kb: Size of each file in KB.
+    :type member_kb: int
+    """
+    rand = random.Random(0)
+    words = [bytes(rand.choices(range(97, 123), k=rand.randint(2, 10))) for _ in range(512)]
+    with zipfile.ZipFile(archive, "w", zipfile.ZIP_DEFLATED) as zip_file:
+        for index in range(members):
+            data = b" ".join(rand.choices(words, k=member_kb * 200))[:member_kb * 1024]
+            zip_file.writestr(f"bench/dir-{index % 50:02d}/sub-{index % 7}/file-{index:05d}.txt", data)
+
+
+def extractall(archive: str, dest_dir: str):
+    """
+    extractall will extract the archive with zipfile.ZipFile.extractall().
+    :param archive: Full path to the archive.
+    :type archive: str
+    :param dest_dir: Destination directory.
+    :type dest_dir: str
+    """
+    with zipfile.ZipFile(archive, "r") as zip_file:
+        zip_file.extractall(dest_dir)
+
+
+def median(values: list) -> float:
+    """
+    median will return the median of the values.
+    :param values: List of numbers.
+    :type values: list
+    :return: The median.
+    :rtype: float
+    """
+    values = sorted(values)
+    middle = len(values) // 2
+    if len(values) % 2 == 1:
+        return values[middle]
+    return (values[middle - 1] + values[middle]) / 2
+
+
+def time_extractor(extract, archive: str, work_dir: str, runs: int) -> float:
+    """
+    time_extractor will run the extractor 'runs' times into a new directory and return the median seconds.
+    :param extract: Function taking the archive and the destination directory.
+    :type extract: callable
+    :param archive: Full path to the archive.
+    :type archive: str
+    :param work_dir: Directory to create the destination directories in.
+    :type work_dir: str
+    :param runs: Number of runs.
+    :type runs: int
+    :return: The median seconds.
+    :rtype: float
+    """
+    results = []
+    for _ in range(runs):
+        dest_dir = tempfile.mkdtemp(dir=work_dir)
+        start = time.perf_counter()
+        extract(archive, dest_dir)
+        results.append(time.perf_counter() - start)
+        shutil.rmtree(dest_dir)
+    return median(results)
+
+
+def main():
+    """
+    Create the synthetic archive and print the median extraction time of each extractor.
+    """
+    runs = int(os.getenv("BENCH_RUNS", "3"))
+    members = int(os.getenv("BENCH_MEMBERS", "2000"))
+    member_kb = int(os.getenv("BENCH_MEMBER_KB", "64"))
+    runner = load_runner()
+
+    work_dir = tempfile.mkdtemp()
+    try:
+        archive = os.path.join(work_dir, "bench.zip")
+        create_archive(archive, members, member_kb)
+        size_mb = os.path.getsize(archive) / 1024 / 1024
+        print(f"Archive: {members} files of {member_kb} KB ({size_mb:.1f} MB compressed), CPUs: {os.cpu_count()}")
+        print(f"Runs per extractor: {runs}")
+        print(f'{"extractor":<24}{"time (ms)":>12}{"speedup":>10}')
+
+        baseline = time_extractor(extractall, archive, work_dir, runs)
+        print(f'{"extractall":<24}{baseline * 1000:>12.1f}{1:>10.2f}')
+        for workers in [1, 2, 4, 8]:
+            os.environ["RUNNER_EXTRACT_WORKERS"] = str(workers)
+            seconds = time_extractor(lambda src, dest: runner.Decompress(src).extract_to(dest), archive, work_dir,
+                                     runs)
+            print(f'{f"Decompress {workers} threads":<24}{seconds * 1000:>12.1f}{baseline / seconds:>10.2f}')
+    finally:
+        shutil.rmtree(work_dir)
+
+
+if __name__ == "__main__":
+    main()
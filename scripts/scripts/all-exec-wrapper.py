@@ -19,11 +19,35 @@
 # Supported variables:
 #   WRAPPER_BINARY - Binary to be executed. One of 'deno', 'nushell', 'rustpython'.
 #   WRAPPER_BIN_DIR - Directory where the binary is downloaded to and executed from.
-#   WRAPPER_DOWNLOAD_URL - Download URL for the binary.
+#   WRAPPER_DOWNLOAD_URL - Download URL for the script.
 #   WRAPPER_REMOTE_REPO - The URL of the remote repository hosting the script
 #   WRAPPER_REMOTE_VERSION - The version of the remote repository, used in the URL to download the script.
 #   WRAPPER_REMOTE_SCRIPT - The name of the script to be executed.
 #   WRAPPER_LOG_LEVEL - Log level of the exec wrapper.
+#   WRAPPER_LOCK_TIMEOUT - Seconds to wait for another wrapper on this host to finish installing the binary.
+#   WRAPPER_OUTPUT_TAIL_LINES - Number of lines of stdout and stderr kept for error reporting.
+#   WRAPPER_IN_PROCESS - Run rustpython scripts in the wrapper's Python interpreter instead of the rustpython binary.
+#   WRAPPER_DENO_COMPILE - Compile Deno scripts from a release tag into cached executables with 'deno compile'.
+#   WRAPPER_IN_MEMORY - Pass the script to the binary without writing it to disk.
+#   WRAPPER_HTTP_CLIENT - HTTP client used for downloads. One of 'auto', 'requests', 'urllib'.
+#   WRAPPER_MIRRORS - Comma separated list of mirrors (URLs or directories) to download the binaries from.
+#   WRAPPER_MIRROR_RACE - Race the mirrors and download from the first to respond instead of trying them in order.
+#   WRAPPER_COMPRESSION - Compressed binaries to try before the uncompressed binary. 'auto', 'none', or 'zst,xz,gz'.
+#   WRAPPER_BINARY_VERSION - Version of the binary. Versions are installed side by side in WRAPPER_BIN_DIR/versions.
+#   WRAPPER_DELTA_UPDATES - Download a bsdiff patch from the installed version instead of the full binary.
+#   WRAPPER_VERSION_GRACE_DAYS - Days to keep a binary version after it's replaced by another version.
+#   WRAPPER_ROLLOUT_WINDOW - Seconds over which hosts upgrade to a new WRAPPER_BINARY_VERSION.
+#   WRAPPER_UPGRADE_URGENT - Upgrade to WRAPPER_BINARY_VERSION now, ignoring WRAPPER_ROLLOUT_WINDOW.
+#   WRAPPER_AGENT_ID - ID of the host used to pick its place in the rollout window. Default: the hostname.
+#   WRAPPER_DOWNLOAD_RETRIES - Number of times a failed binary download is retried.
+#   WRAPPER_BACKOFF_MAX - Maximum seconds to wait between download retries.
+#   WRAPPER_BATCH_URLS - Comma or newline separated list of script URLs to run in one wrapper invocation.
+#   WRAPPER_BATCH_MANIFEST - URL or path of a file with the script URLs to run, one per line.
+#   WRAPPER_BATCH_WORKERS - Number of batch scripts to run at the same time.
+#   WRAPPER_RESOURCE_SUMMARY - Print a JSON line with the CPU time, peak memory and output of each script.
+#   WRAPPER_MAX_CONCURRENT - Maximum number of binaries run by wrappers at the same time on the host.
+#   WRAPPER_BUNDLE_FILES - Comma separated list of Python modules to download with the rustpython script.
+#   WRAPPER_BUNDLE_IMPORTS - Download the Python modules the rustpython script imports from the same repo path.
 #
 #   EXEC_DENO_RUN_FLAGS - Command line flags for 'deno run'.
 #     See https://docs.deno.com/runtime/manual/getting_started/command_line_interface#script-arguments
@@ -36,6 +60,12 @@
 #     --allow-net - Allow network access
 #     --allow-read - Allow file system read access
 #     --allow-write - Allow file system write access
+#   EXEC_NICE - Nice level (-20 to 19) of the binary. Higher is lower priority.
+#   EXEC_IO_CLASS - IO scheduling class of the binary on Linux. One of 'idle', 'best-effort'.
+#   EXEC_IO_LEVEL - IO priority (0 to 7) within the 'best-effort' class. Higher is lower priority.
+#   EXEC_CPU_AFFINITY - CPUs the binary runs on. 'first', 'last', or a list of CPUs such as '0,2-3'.
+#   EXEC_CPU_LIMIT - Seconds of CPU time before the binary is killed.
+#   EXEC_MEMORY_LIMIT - Megabytes of memory before allocations in the binary fail.
 #
 #   TS_LOG_LEVEL - Log level for TypeScript programs.
 #     See https://deno.land/std/log/mod.ts?s=LogLevels
@@ -51,13 +81,19 @@
 
 """
 all-exec-wrapper will run a script from a URL. The binary doesn't exist, it is downloaded to WRAPPER_BIN_DIR. The
-script is downloaded from the URL into a tmp file, and then the binary is executed passing the script as an argument.
-Note that deno does not need to download the script as it can run it directly from the command line.
+script is downloaded from the URL into the script cache in WRAPPER_BIN_DIR, and then the binary is executed passing the
+script as an argument. Note that deno does not need to download the script as it can run it directly from the command
+line.
+
+The script cache is revalidated on every run with a conditional request (ETag/Last-Modified). Scripts composed from a
+WRAPPER_REMOTE_VERSION that is a release tag (v0.0.1) never change and are used from the cache without a request.
 
 Uninstallation is done by removing the binaries downloaded to WRAPPER_BIN_DIR. all-exec-wrapper does not keep track of
 the binaries.
 
-The requests module is not a base module and required.
+The requests module is used for downloads if it's installed. Otherwise, urllib.request from the standard library is
+used. HTTP modules are imported only when a download is needed, so a run with the binary and the script already cached
+does not import them.
 
 How to use Deno to specify remote URLs. Given the following script:
   https://raw.githubusercontent.com/NiceGuyIT/pimp-my-tactical/v0.0.1/scripts/wrapper/hello-world.ts
@@ -72,6 +108,17 @@ The final form is as follows:
 
 Environmental variables
 - WRAPPER_LOG_LEVEL sets the log level.
+- WRAPPER_LOCK_TIMEOUT is the number of seconds to wait for another wrapper on this host to finish downloading the
+  binary. Only one wrapper per host downloads a binary; the others wait and then use the downloaded binary.
+  Default: 600
+- WRAPPER_OUTPUT_TAIL_LINES is the number of lines of stdout and stderr kept in memory to report errors. The output of
+  the script is forwarded as it arrives; only the last lines are kept.
+  Default: 100
+- WRAPPER_IN_PROCESS=true runs the script in the Python interpreter running the wrapper when WRAPPER_BINARY is
+  'rustpython'. The rustpython binary is not downloaded or executed. The script runs in a new __main__ namespace with
+  sys.argv and the environment set as if it was run by the binary. Note that logging is already configured by the
+  wrapper, so logging.basicConfig() in the script has no effect.
+  Default: false
 - WRAPPER_BIN_DIR is the directory to save the binaries.
   Default:
     Windows: 'C:\\ProgramData\\exec-wrapper\\bin'
@@ -81,21 +128,143 @@ Environmental variables
 - WRAPPER_REMOTE_REPO is used as the base URL to compose the remote URL for Deno. Alternative to WRAPPER_DOWNLOAD_URL.
 - WRAPPER_REMOTE_VERSION is used as the version to compose the remote URL for Deno. Alternative to WRAPPER_DOWNLOAD_URL.
 - WRAPPER_REMOTE_SCRIPT is used as the path and script to compose the remote URL for Deno. Alternative to WRAPPER_DOWNLOAD_URL.
+  The remote URL can be used for all binaries. A release tag in WRAPPER_REMOTE_VERSION allows the script to be cached.
+- WRAPPER_DENO_COMPILE=true compiles Deno scripts with 'deno compile' into an executable cached in
+  WRAPPER_BIN_DIR/compiled, and later runs execute the cached executable directly. Only scripts from a release tag in
+  WRAPPER_REMOTE_VERSION are compiled. The executables of other versions of the script are removed when a new version
+  is compiled. EXEC_DENO_RUN_FLAGS and EXEC_DENO_PERMISSION_FLAGS are compiled into the executable; changing them or
+  the deno binary compiles the script again. EXEC_DENO_RUN_FLAGS=--reload bypasses the compiled executable.
+  Default: false
+- WRAPPER_IN_MEMORY=true downloads the script into memory and passes it to the binary without writing it to disk. On
+  Linux, the script is written to an anonymous memory file (memfd) and passed as /dev/fd/N. Elsewhere, Deno reads the
+  script from stdin. If neither is possible, the script cache is used.
+  Default: false
+- WRAPPER_HTTP_CLIENT is the HTTP client used for downloads. 'requests' uses the requests module. 'urllib' uses
+  urllib.request from the standard library, which imports faster, especially in RustPython. 'auto' uses requests if
+  it's installed and urllib otherwise.
+  Default: auto
+- WRAPPER_MIRRORS is a comma separated list of mirrors to download the binaries from, in priority order. A mirror is
+  the base URL of an HTTP server (http://mirror.example.lan/exec-wrapper/) or a directory, such as a file share
+  (\\\\server\\share\\exec-wrapper), that has the same files as the public download URL. If all mirrors fail, the
+  binary is downloaded from the public URL.
+- WRAPPER_MIRROR_RACE=true sends the request to all mirrors at the same time and downloads from the first mirror to
+  respond. The other responses are closed. With WRAPPER_MIRROR_RACE=false, the mirrors are tried in order.
+  Default: true
+- WRAPPER_COMPRESSION is a comma separated list of compression formats to try, in order, before downloading the
+  uncompressed binary. The compressed binary is the binary URL with the extension added
+  (deno-x86_64-pc-windows-msvc.exe.xz) and is decompressed as it's downloaded. 'zst' requires the zstandard module.
+  'auto' tries 'zst,xz,gz' with the modules that are available. 'none' downloads the uncompressed binary. Every
+  format that is tried costs a request, so only enable the formats the mirrors and WRAPPER_DOWNLOAD_URL publish. An
+  interrupted compressed download is downloaded again as the uncompressed binary.
+  Default: none
+- WRAPPER_BINARY_VERSION is the version of the binary to run. Each version is installed in its own directory,
+  WRAPPER_BIN_DIR/versions/<binary>/<version>/, and WRAPPER_BIN_DIR/versions/<binary>/current holds the version that
+  is installed. The file is replaced atomically when a new version is installed, and the version it replaced is
+  removed after WRAPPER_VERSION_GRACE_DAYS. The versioned binary is downloaded from <download URL>/<version>/<binary>.
+  If WRAPPER_BINARY_VERSION is not defined, the binary is WRAPPER_BIN_DIR/<binary> and is never upgraded.
+- WRAPPER_DELTA_UPDATES=true downloads a bsdiff patch from the current version to WRAPPER_BINARY_VERSION,
+  <download URL>/<version>/<binary>.from-<current version>.bsdiff, and applies it to the current binary. The full
+  binary is downloaded if the patch is not available. The patch is only used if the SHA-256 hash and size of the new
+  binary are published next to it, <patch>.json with {"sha256": "<hex digest>", "size": <bytes>}, and the patched
+  binary is checked against them. The patch is downloaded to a temporary file. This requires the bsdiff4 module,
+  which holds both binaries in memory while the patch is applied.
+  Default: false
+- WRAPPER_VERSION_GRACE_DAYS is the number of days to keep a binary version after it's replaced, so wrappers that are
+  still running the old version are not affected.
+  Default: 7
+- WRAPPER_ROLLOUT_WINDOW spreads the upgrade to a new WRAPPER_BINARY_VERSION over this many seconds, so the hosts
+  don't all download the binary at the same time. Each host waits a fixed offset within the window, computed from the
+  hash of WRAPPER_AGENT_ID, the binary and the version, after it first sees the new version. Until then, the current
+  version is run. First installs are not delayed. Set WRAPPER_UPGRADE_URGENT=true to upgrade right away.
+  Default: 0 (upgrade right away)
+- WRAPPER_AGENT_ID identifies the host in the rollout, i.e. {{agent.agent_id}} in Tactical RMM.
+  Default: the hostname
+- WRAPPER_DOWNLOAD_RETRIES is the number of times a failed binary download is retried. The wait between retries
+  doubles from 1 second up to WRAPPER_BACKOFF_MAX with random jitter. Network errors, 429 and 5xx responses are
+  retried. If the server sends a Retry-After header, it's used instead, up to WRAPPER_BACKOFF_MAX.
+  Default: 2
+- WRAPPER_BACKOFF_MAX is the maximum number of seconds to wait between download retries.
+  Default: 300
+- DENO_DIR is set to WRAPPER_BIN_DIR/deno-dir, so Deno's module and compile cache persists between runs, unless
+  DENO_DIR is already defined.
 - EXEC_DENO_RUN_FLAGS are added to the command line for 'deno run'.
 - EXEC_DENO_PERMISSION_FLAGS are added to the command line for 'deno run' to set the permissions.
   See https://deno.land/manual/basics/permissions
+- EXEC_NICE, EXEC_IO_CLASS, EXEC_IO_LEVEL, EXEC_CPU_AFFINITY, EXEC_CPU_LIMIT and EXEC_MEMORY_LIMIT are applied to the
+  binary before it starts, so scripts don't compete with the user's work. On Linux and macOS, the command is run
+  through nice, ionice, taskset and prlimit, so every thread and process started by the binary inherits them. If one
+  of these tools is not installed, the option is applied to every thread of the binary right after it starts. On
+  Windows, the options are applied to the process right after it starts. They are not applied to WRAPPER_IN_PROCESS
+  scripts. Options that can't be applied are logged and ignored.
+  - EXEC_NICE is the nice level. Negative levels require root. On Windows, the nice level is mapped to a priority
+    class: 15 and above is Idle, 5 and above is Below Normal, -5 and below is Above Normal and -15 and below is High.
+  - EXEC_IO_CLASS and EXEC_IO_LEVEL set the IO scheduling class and level with ioprio_set() on Linux. 'idle' only
+    gets disk time when no other process needs it.
+    Default EXEC_IO_LEVEL: 4
+  - EXEC_CPU_AFFINITY pins the binary to the CPUs. 'first' and 'last' are the first and last CPU available to the
+    wrapper. Linux and Windows only.
+  - EXEC_CPU_LIMIT sets RLIMIT_CPU. The binary receives SIGXCPU after the limit and is killed 5 seconds of CPU time
+    later. Linux only.
+  - EXEC_MEMORY_LIMIT sets RLIMIT_DATA, the private writable memory of the binary. RLIMIT_AS is not used because
+    Deno (V8) reserves far more address space than it uses. Linux only.
 - All environmental variables are passed to the child process by default!
+- WRAPPER_BATCH_URLS is a comma or newline separated list of script URLs to run with WRAPPER_BINARY in one wrapper
+  invocation. WRAPPER_BATCH_MANIFEST is the URL or path of a file with the script URLs, one per line. Blank lines and
+  lines starting with '#' are ignored. The binary is installed once and the scripts are downloaded and run by
+  WRAPPER_BATCH_WORKERS workers. The output of each script is collected and printed as one block with the exit status
+  and timing of the script, followed by a summary of all scripts. The wrapper fails if any script fails. Batch
+  scripts always run from the script cache, so WRAPPER_IN_PROCESS and WRAPPER_IN_MEMORY are ignored.
+  WRAPPER_DOWNLOAD_URL and WRAPPER_REMOTE_* are ignored in batch mode.
+- WRAPPER_BATCH_WORKERS is the number of batch scripts to run at the same time.
+  Default: 4
+- WRAPPER_RESOURCE_SUMMARY=true prints one line to stdout when the wrapper exits, "exec-wrapper-summary: " followed
+  by JSON with the wall time, user and system CPU time, peak RSS, and bytes written to stdout and stderr of each
+  script the binary ran, and the totals. The line is printed even if the script failed. Scripts run by
+  WRAPPER_IN_PROCESS are not child processes and are not included.
+  Default: false
+- WRAPPER_MAX_CONCURRENT is the maximum number of binaries run by wrappers at the same time on the host, including
+  the scripts of a batch. Other runs wait and start in the order they arrived. The wait time is logged. The wrappers
+  share the limit through tickets in WRAPPER_BIN_DIR/.exec-slots, so all wrappers need the same WRAPPER_BIN_DIR and
+  WRAPPER_MAX_CONCURRENT. 0 is no limit.
+  Default: 0
+- WRAPPER_BUNDLE_FILES is a comma separated list of files, relative to the rustpython script URL (helpers.py,
+  lib/util.py), that are downloaded with the script. WRAPPER_BUNDLE_IMPORTS=true also downloads the modules the
+  script imports, with 'import helpers' or 'from .lib import util', from the same directory of the repo, and the
+  modules they import. Modules in the standard library or installed for the wrapper's interpreter are skipped, and
+  imports that don't exist in the repo are expected to be installed. For 'from package import name', the module
+  package/name is only looked for if package.py or package/__init__.py is in the repo. List the modules of namespace
+  packages (without __init__.py) in WRAPPER_BUNDLE_FILES. Modules that don't exist are remembered in the
+  script cache for an hour, or for good with a release tag in WRAPPER_REMOTE_VERSION. The files are downloaded at the
+  same time into WRAPPER_BIN_DIR/cache/bundles/<hash>/ through the script cache, and the script is run from there, so
+  the modules are first on the module path.
+  Default WRAPPER_BUNDLE_IMPORTS: false
+- Installed binaries are verified against a manifest, <binary>.manifest.json, with the size, modification time,
+  inode and SHA-256 hash of the binary. The manifest is written right after the download. The binary is hashed only
+  if the size, modification time or inode changed. A binary that doesn't match its hash, or has no manifest, is
+  downloaded again.
+"""
+import time
+
+"""
+wrapper_start is the time the wrapper started. It's used to report the time spent in each phase of the wrapper.
 """
+wrapper_start: float = time.perf_counter()
+
+import collections
+import hashlib
+import json
 import logging
 import os
 import platform
+import random
 import re
+import shutil
 import traceback
 
-import requests
 import subprocess
 import sys
 import tempfile
+import threading
 
 """
 logger is the global logging instance set by get_logger().
@@ -113,144 +282,2739 @@ config: dict = {
     # variables that alter the commands line options for the executable.
     "exec": {},
 
-    # tmp_dir references a randomly generated directory.
-    # The initial value is the system tmp directory. It's assigned a random directory in set_tmp_dir().
-    "tmp_dir": None,
+    # tmp_dir references a randomly generated directory.
+    # The initial value is the system tmp directory. It's assigned a random directory in set_tmp_dir().
+    "tmp_dir": None,
+
+    # tmp_file references a randomly generated directory.
+    # Note: The initial value is the system tmp directory. It's assigned a random file in set_tmp_file().
+    "tmp_file": None,
+
+    # bin_dir is the directory that holds the binaries.
+    "bin_dir": None,
+
+    # bin_file is the full path to the binary.
+    "bin_file": None,
+
+    # cache_dir is the directory that holds the downloaded scripts. It's a subdirectory of bin_dir.
+    "cache_dir": None,
+}
+
+"""
+immutable_version_regex matches WRAPPER_REMOTE_VERSION values that are release tags (v0.0.1) rather than branches
+(main). Scripts downloaded from a release tag never change and are served from the cache without a network request.
+"""
+immutable_version_regex = re.compile(r"^v?\d+\.\d+\.\d+$")
+
+"""
+missing_cache_seconds is the number of seconds a script or module that does not exist (404) is remembered in the
+script cache before it's requested again. Immutable URLs are remembered until the cache is removed.
+"""
+missing_cache_seconds = 3600
+
+"""
+http_client is the HTTP client module used for downloads, "requests" or "urllib". It's set by get_http_client().
+"""
+http_client: str = None
+http_client_lock = threading.Lock()
+
+"""
+phase_timings holds the seconds spent in each phase of the wrapper. It's reported at debug level when the wrapper exits.
+"""
+phase_timings: dict = {"imports": time.perf_counter() - wrapper_start}
+
+"""
+resource_usage holds the resources used by each child process. It's printed when the wrapper exits if
+WRAPPER_RESOURCE_SUMMARY is true.
+"""
+resource_usage: list = []
+resource_usage_lock = threading.Lock()
+
+"""
+ioprio_syscalls maps the machine to the ioprio_set() system call number on Linux.
+"""
+ioprio_syscalls: dict = {
+    "x86_64": 251,
+    "amd64": 251,
+    "i386": 289,
+    "i686": 289,
+    "aarch64": 30,
+    "arm64": 30,
+    "riscv64": 30,
+    "armv7l": 314,
+    "ppc64le": 273,
+    "s390x": 282,
+}
+
+"""
+version_regex matches the valid values of WRAPPER_BINARY_VERSION. The version is used as a directory name.
+"""
+version_regex = re.compile(r"^[A-Za-z0-9][A-Za-z0-9._-]*$")
+
+"""
+cancel_event is set when one of the concurrent downloads fails. The other downloads stop at the next chunk.
+"""
+cancel_event = threading.Event()
+
+"""
+download_chunk_size is the number of bytes read from the network and written to disk at a time.
+"""
+download_chunk_size: int = 1024 * 1024
+
+"""
+download_attempts is the number of times a binary download is attempted. Every attempt after the first resumes the
+partial download with an HTTP Range request.
+"""
+download_attempts: int = 3
+
+"""
+download_timeout is the connect and read timeout in seconds. A stalled connection is treated as an interrupted download.
+"""
+download_timeout: int = 30
+
+"""
+output_line_limit is the maximum number of bytes read from the script output at a time. Longer lines are forwarded in
+pieces, so a script that never prints a newline does not use unbounded memory.
+"""
+output_line_limit: int = 64 * 1024
+
+
+def get_http_client() -> str:
+    """
+    get_http_client will return the HTTP client module used for downloads, importing it the first time. See
+    WRAPPER_HTTP_CLIENT. The time to import the module is recorded in phase_timings.
+    :return: "requests" or "urllib"
+    :rtype: str
+    """
+    global logger, http_client
+    with http_client_lock:
+        if http_client is None:
+            import_http_client()
+    return http_client
+
+
+def import_http_client() -> None:
+    """
+    import_http_client will import the HTTP client module and set http_client. See get_http_client().
+    """
+    global logger, http_client
+    start = time.perf_counter()
+    client = get_config_option("wrapper", "WRAPPER_HTTP_CLIENT", "auto").lower()
+    if client in ("auto", "requests"):
+        try:
+            import requests
+            http_client = "requests"
+        except ImportError:
+            if client == "requests":
+                logger.error(f"WRAPPER_HTTP_CLIENT is 'requests' but the requests module is not installed")
+                raise
+            logger.debug(f"The requests module is not installed. Using urllib.")
+    if http_client is None:
+        import urllib.request
+        http_client = "urllib"
+    phase_timings[f"import {http_client}"] = time.perf_counter() - start
+    logger.debug(f"HTTP client: {http_client} (imported in {phase_timings[f'import {http_client}']:.3f}s)")
+
+
+def get_interrupted_errors() -> tuple:
+    """
+    get_interrupted_errors will return the exceptions raised when a download is interrupted by the network, as opposed
+    to an HTTP error status. Interrupted downloads are retried.
+    :return: Tuple of exception classes.
+    :rtype: tuple
+    """
+    if get_http_client() == "requests":
+        import requests
+        return requests.ConnectionError, requests.Timeout, requests.exceptions.ChunkedEncodingError
+    return ConnectionError, TimeoutError
+
+
+def http_get(url: str, headers: dict = None):
+    """
+    http_get will send a GET request and return the streaming response. The response has the subset of the
+    requests.Response interface used by the wrapper: status_code, headers, iter_content(), raise_for_status() and
+    close(). It can be used as a context manager.
+    :param url: URL to download.
+    :type url: str
+    :param headers: Request headers.
+    :type headers: dict
+    :return: The response.
+    :rtype: requests.Response | UrllibResponse
+    """
+    # requests does not support file:// URLs (mirrors on a file share).
+    if get_http_client() == "requests" and not url.startswith("file:"):
+        import requests
+        return requests.get(url, headers=headers or {}, stream=True, timeout=download_timeout)
+
+    import urllib.error
+    import urllib.request
+    request = urllib.request.Request(url, headers=headers or {})
+    try:
+        return UrllibResponse(url, urllib.request.urlopen(request, timeout=download_timeout))
+    except urllib.error.HTTPError as err2:
+        # urllib raises non-2xx responses (304, 404, 416) as exceptions. HTTPError is also the response.
+        return UrllibResponse(url, err2)
+    except urllib.error.URLError as err2:
+        raise ConnectionError(f'Failed to connect to "{url}": {err2.reason}') from err2
+
+
+class UrllibResponse:
+    """
+    UrllibResponse wraps a urllib.request response in the subset of the requests.Response interface used by the
+    wrapper. Network errors while reading are raised as ConnectionError.
+    """
+
+    def __init__(self, url: str, response):
+        self.url = url
+        self.response = response
+        # file:// responses don't have a status code.
+        self.status_code = getattr(response, "status", None) or getattr(response, "code", None) or 200
+        # HTTPMessage.get() is case-insensitive, the same as requests' headers.
+        self.headers = response.headers
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def iter_content(self, chunk_size: int = 1):
+        import http.client
+        import socket
+        expected = self.headers.get("Content-Length")
+        received = 0
+        while True:
+            try:
+                chunk = self.response.read(chunk_size)
+            except (OSError, socket.timeout, http.client.HTTPException) as err2:
+                raise ConnectionError(f'Download of "{self.url}" was interrupted: {err2}') from err2
+            if not chunk:
+                break
+            received += len(chunk)
+            yield chunk
+        # urllib does not raise an error if the connection is closed before Content-Length bytes are received.
+        if expected is not None and received < int(expected):
+            raise ConnectionError(f'Download of "{self.url}" was interrupted: received {received} of {expected} bytes')
+
+    def raise_for_status(self) -> None:
+        if self.status_code >= 400:
+            import urllib.error
+            raise urllib.error.HTTPError(self.url, self.status_code, f"{self.status_code} Error for url: {self.url}",
+                                         self.headers, None)
+
+    def close(self) -> None:
+        self.response.close()
+
+
+def report_phases() -> None:
+    """
+    report_phases will log the time spent in each phase of the wrapper at debug level.
+    """
+    global logger
+    phases = ", ".join(f"{name} {seconds:.3f}s" for name, seconds in phase_timings.items())
+    logger.debug(f"Phase timings: {phases}; total {time.perf_counter() - wrapper_start:.3f}s")
+
+
+def report_resource_usage() -> None:
+    """
+    report_resource_usage will print the resources used by the scripts as a single line of JSON, prefixed with
+    "exec-wrapper-summary: ", if WRAPPER_RESOURCE_SUMMARY is true.
+    """
+    global config
+    if "wrapper" not in config or not get_config_option("wrapper", "WRAPPER_RESOURCE_SUMMARY", False):
+        return
+    with resource_usage_lock:
+        runs = list(resource_usage)
+    summary = {
+        "binary": config["wrapper"].get("WRAPPER_BINARY"),
+        "binary_version": config["wrapper"].get("WRAPPER_BINARY_VERSION"),
+        "host": platform.node(),
+        "wrapper_seconds": round(time.perf_counter() - wrapper_start, 3),
+        "user_seconds": round(sum(run["user_seconds"] for run in runs), 3),
+        "system_seconds": round(sum(run["system_seconds"] for run in runs), 3),
+        "peak_rss_bytes": max([run["peak_rss_bytes"] for run in runs] or [0]),
+        "stdout_bytes": sum(run["stdout_bytes"] for run in runs),
+        "runs": runs,
+    }
+    sys.stdout.flush()
+    print(f"exec-wrapper-summary: {json.dumps(summary, separators=(',', ':'))}")
+    sys.stdout.flush()
+
+
+def label_resource_usage(url: str, script: str = None) -> None:
+    """
+    label_resource_usage will add the URL of the script to its resource usage. The resource usage has the script
+    argument of the binary, which may be a cached file or a file descriptor.
+    :param url: URL of the script.
+    :type url: str
+    :param script: Script argument of the binary. Default: all resource usage without a URL
+    :type script: str
+    """
+    with resource_usage_lock:
+        for usage in resource_usage:
+            if "url" not in usage and (script is None or usage["script"] == script):
+                usage["url"] = url
+
+
+def record_phase(name: str, start: float) -> None:
+    """
+    record_phase will save the seconds since start as the time spent in the phase.
+    :param name: Name of the phase.
+    :type name: str
+    :param start: Start time of the phase from time.perf_counter().
+    :type start: float
+    """
+    phase_timings[name] = time.perf_counter() - start
+
+
+def download_binary(binary_name: str) -> None:
+    """
+    Download the binary and copy it to bin_file. The binary is streamed to "bin_file.part" in chunks, so it's never
+    held in memory. An interrupted download is resumed from the end of the ".part" file, and the ".part" file is
+    renamed to bin_file only after the download is complete.
+    """
+    global logger, config
+
+    urls = get_download_urls(binary_name)
+    if not urls:
+        return None
+    # The public URL is the last URL.
+    url = urls[-1]
+
+    part_file = f'{config["bin_file"]}.part'
+    if not os.path.isdir(os.path.dirname(part_file)):
+        # Create the version directory
+        os.makedirs(os.path.dirname(part_file))
+    start = time.perf_counter()
+    try:
+        if (
+            get_config_option("wrapper", "WRAPPER_DELTA_UPDATES", False)
+            and not os.path.isfile(part_file)
+            and download_delta(binary_name, urls, part_file)
+        ):
+            os.chmod(part_file, 0o755)
+            os.replace(part_file, config["bin_file"])
+            remove_resume_validator(part_file)
+            write_manifest(config["bin_file"], config["bin_file"])
+            return
+
+        compression_exts = get_compression_exts()
+        attempts = get_config_option("wrapper", "WRAPPER_DOWNLOAD_RETRIES", download_attempts - 1) + 1
+        attempt = 0
+        while True:
+            attempt += 1
+            retry_after = None
+            try:
+                logger.debug(f'Downloading binary from URLs {urls} to file "{part_file}" (attempt {attempt})')
+                complete = None
+                # A partial download is always resumed from the uncompressed binary. A compressed download does not
+                # save a validator for the uncompressed binary, so download_file() starts it over.
+                while complete is None and compression_exts and not os.path.isfile(part_file):
+                    complete = download_compressed(urls, part_file, compression_exts[0])
+                    if complete is None:
+                        compression_exts.pop(0)
+                if complete is None:
+                    complete = download_file(urls, part_file)
+                if complete:
+                    break
+                logger.warning(f'Download of "{url}" ended before the file was complete')
+            except get_interrupted_errors() as err2:
+                logger.warning(f'Download of "{url}" was interrupted: {err2}')
+            except RetryLater as err2:
+                logger.warning(f"Server is busy or failed: {err2}")
+                retry_after = err2.retry_after
+            if attempt >= attempts:
+                raise ValueError(f'Failed to download binary from URL "{url}" after {attempt} attempts')
+            wait_before_retry(attempt, retry_after)
+
+        os.chmod(part_file, 0o755)
+        # os.replace() is atomic. Other processes see either the old bin_file or the complete new one.
+        os.replace(part_file, config["bin_file"])
+        remove_resume_validator(part_file)
+        # The manifest describes the binary in place. Until it's written, other wrappers don't accept the binary and
+        # wait for the install lock, which is held until the manifest is written.
+        write_manifest(config["bin_file"], config["bin_file"])
+    except PermissionError as err2:
+        logger.error(f'PermissionError({err2.errno}): "{err2.strerror}" writing to file "{part_file}"')
+        raise
+    except CancelledDownload:
+        logger.info(f'Download of binary from URL "{url}" was cancelled')
+        raise
+    except:
+        logger.error(f'Failed to download binary from URL "{url}"')
+        logger.error(traceback.format_exc())
+        logger.error(sys.exc_info()[0])
+        raise
+
+    elapsed = time.perf_counter() - start
+    size = os.path.getsize(config["bin_file"])
+    logger.debug(f'Downloaded {size / 1048576:.1f} MiB in {elapsed:.2f}s '
+                 f'({size / 1048576 / max(elapsed, 0.001):.1f} MiB/s), peak RSS {get_peak_rss() / 1048576:.1f} MiB')
+
+
+def download_file(urls: list, filename: str) -> bool:
+    """
+    download_file will stream the URL to filename in chunks of download_chunk_size. If filename already exists, the
+    download is resumed from the end of the file using an HTTP Range request. The validator (ETag or Last-Modified)
+    of the response that started the file is sent in If-Range, so a mirror or origin with a different file sends the
+    whole file instead of the rest of it. If the server does not support ranges, the file has no validator or the
+    Content-Range does not start at the end of the file, the file is downloaded from the beginning.
+    :param urls: URLs of the mirrors in priority order, followed by the public URL. See open_download().
+    :type urls: list
+    :param filename: Filename (full path) to save the download.
+    :type filename: str
+    :return: True if the download is complete; False if the server closed the connection early.
+    :rtype: bool
+    """
+    global logger
+
+    offset = 0
+    headers = {}
+    if os.path.isfile(filename):
+        offset = os.path.getsize(filename)
+    if offset > 0:
+        validator = read_resume_validator(filename)
+        if validator is None:
+            logger.info(f'Partial download "{filename}" has no validator. Restarting the download.')
+            offset = 0
+        else:
+            headers["Range"] = f"bytes={offset}-"
+            headers["If-Range"] = validator
+            logger.debug(f'Resuming download of "{filename}" at byte {offset} (If-Range: {validator})')
+
+    start = time.perf_counter()
+    received = 0
+    (url, response) = open_download(urls, headers)
+    with response:
+        logger.debug(f"Status code: {response.status_code}")
+        if response.status_code == 416:
+            # The partial file does not fit the remote file, i.e. the remote file changed. Start over.
+            logger.info(f'Range not satisfiable. Deleting partial download "{filename}"')
+            os.remove(filename)
+            return False
+        check_retry_later(url, response)
+        response.raise_for_status()
+        if offset > 0 and response.status_code != 206:
+            logger.info(f'Server did not honor the Range request or the file changed. Restarting download of "{url}"')
+            offset = 0
+        elif offset > 0 and not response.headers.get("Content-Range", "").startswith(f"bytes {offset}-"):
+            logger.warning(f'Server returned Content-Range "{response.headers.get("Content-Range")}" for a download '
+                           f'resumed at byte {offset}. Deleting partial download "{filename}"')
+            os.remove(filename)
+            remove_resume_validator(filename)
+            return False
+        if offset == 0:
+            write_resume_validator(filename, response)
+
+        expected = None
+        if "Content-Length" in response.headers:
+            expected = offset + int(response.headers["Content-Length"])
+
+        with open(filename, "ab" if offset > 0 else "wb") as file:
+            for chunk in response.iter_content(chunk_size=download_chunk_size):
+                check_cancelled()
+                file.write(chunk)
+                received += len(chunk)
+
+    elapsed = time.perf_counter() - start
+    logger.debug(f"Received {received} bytes in {elapsed:.2f}s "
+                 f"({received / 1048576 / max(elapsed, 0.001):.1f} MiB/s)")
+    if expected is not None and offset + received < expected:
+        return False
+    return True
+
+
+def read_resume_validator(filename: str):
+    """
+    read_resume_validator will return the validator saved by write_resume_validator() for the partial download.
+    :param filename: Filename (full path) of the partial download.
+    :type filename: str
+    :return: The ETag or Last-Modified value, or None if the partial download has no validator.
+    :rtype: str
+    """
+    try:
+        with open(f"{filename}.validator", "r") as file:
+            return file.read().strip() or None
+    except OSError:
+        return None
+
+
+def write_resume_validator(filename: str, response) -> None:
+    """
+    write_resume_validator will save the validator of the response next to the partial download, so an interrupted
+    download can be resumed with If-Range. If-Range needs a strong ETag; Last-Modified is used otherwise. If the
+    response has neither, the validator is removed and the download can't be resumed.
+    :param filename: Filename (full path) of the partial download.
+    :type filename: str
+    :param response: The response that starts the download.
+    :type response: requests.Response | UrllibResponse
+    """
+    validator = response.headers.get("ETag")
+    if validator is None or validator.startswith("W/"):
+        validator = response.headers.get("Last-Modified")
+    if validator is None:
+        remove_resume_validator(filename)
+        return
+    with open(f"{filename}.validator", "w") as file:
+        file.write(validator)
+
+
+def remove_resume_validator(filename: str) -> None:
+    """
+    remove_resume_validator will remove the validator of the partial download, if any.
+    :param filename: Filename (full path) of the partial download.
+    :type filename: str
+    """
+    try:
+        os.remove(f"{filename}.validator")
+    except FileNotFoundError:
+        pass
+
+
+def download_compressed(urls: list, filename: str, compression_ext: str) -> bool:
+    """
+    download_compressed will download the compressed binary and decompress it to filename as it's downloaded. The
+    compressed binary is the URL with the compression extension added.
+    :param urls: URLs of the uncompressed binary on the mirrors in priority order, followed by the public URL.
+    :type urls: list
+    :param filename: Filename (full path) to save the decompressed download.
+    :type filename: str
+    :param compression_ext: Compression extension without the dot, i.e. "xz". See get_decompressor().
+    :type compression_ext: str
+    :return: True if the download is complete; False if the download ended early; None if the compressed binary is
+        not available.
+    :rtype: bool
+    """
+    global logger
+
+    decompressor = get_decompressor(compression_ext)
+    start = time.perf_counter()
+    decode_time = 0.0
+    (compressed, decompressed) = (0, 0)
+    (url, response) = open_download([f"{url}.{compression_ext}" for url in urls], {})
+    with response:
+        logger.debug(f"Status code: {response.status_code}")
+        if response.status_code in (403, 404):
+            logger.debug(f'Compressed binary "{url}" is not available')
+            return None
+        check_retry_later(url, response)
+        response.raise_for_status()
+        expected = response.headers.get("Content-Length")
+
+        # The validator of the compressed binary does not validate the uncompressed binary.
+        remove_resume_validator(filename)
+        with open(filename, "wb") as file:
+            for chunk in response.iter_content(chunk_size=download_chunk_size):
+                check_cancelled()
+                compressed += len(chunk)
+                decode_start = time.perf_counter()
+                data = decompressor.decompress(chunk)
+                decode_time += time.perf_counter() - decode_start
+                file.write(data)
+                decompressed += len(data)
+            if hasattr(decompressor, "flush"):
+                data = decompressor.flush()
+                file.write(data)
+                decompressed += len(data)
+
+    elapsed = time.perf_counter() - start
+    logger.debug(f'Received {compressed} compressed bytes from "{url}" in {elapsed:.2f}s, decompressed to '
+                 f'{decompressed} bytes ({decompressed / max(compressed, 1):.1f}x); decode throughput '
+                 f'{decompressed / 1048576 / max(decode_time, 0.001):.1f} MiB/s')
+    # The decompressor reaches the end of the stream only if the compressed binary is complete.
+    eof = getattr(decompressor, "eof", None)
+    if eof is None:
+        # Older zstandard decompressors don't have eof. Only the size of the compressed binary can tell.
+        return expected is not None and compressed >= int(expected)
+    return eof
+
+
+def get_compression_exts() -> list:
+    """
+    get_compression_exts will return the compression extensions to try, in order, from WRAPPER_COMPRESSION. Extensions
+    that can't be decompressed because the module is not available are skipped.
+    :return: List of compression extensions without the dot.
+    :rtype: list
+    """
+    global logger
+    setting = get_config_option("wrapper", "WRAPPER_COMPRESSION", "none").lower()
+    if setting == "none":
+        return []
+    if setting == "auto":
+        wanted = ["zst", "xz", "gz"]
+    else:
+        wanted = [ext.strip().lstrip(".") for ext in setting.split(",") if ext.strip() != ""]
+
+    compression_exts = []
+    for ext in wanted:
+        if get_decompressor(ext) is None:
+            logger.debug(f'Cannot decompress ".{ext}". Skipping.')
+            continue
+        compression_exts.append(ext)
+    return compression_exts
+
+
+def get_decompressor(compression_ext: str):
+    """
+    get_decompressor will return a streaming decompressor for the compression extension. The decompressor has a
+    decompress(data) method and optionally flush() and eof.
+    :param compression_ext: Compression extension without the dot. One of "zst", "xz", "gz".
+    :type compression_ext: str
+    :return: The decompressor, or None if the extension is unknown or the module is not available.
+    :rtype: any
+    """
+    try:
+        if compression_ext == "xz":
+            import lzma
+            return lzma.LZMADecompressor()
+        if compression_ext == "gz":
+            import zlib
+            # 16 + MAX_WBITS expects a gzip header and trailer.
+            return zlib.decompressobj(16 + zlib.MAX_WBITS)
+        if compression_ext == "zst":
+            import zstandard
+            return zstandard.ZstdDecompressor().decompressobj()
+    except ImportError:
+        return None
+    return None
+
+
+def open_download(urls: list, headers: dict) -> tuple:
+    """
+    open_download will send the request to the mirrors and return the response of the first mirror that responds
+    successfully. The mirrors are raced (see race_urls()) if WRAPPER_MIRROR_RACE is true, and tried in order otherwise.
+    If all mirrors fail, the request is sent to the public URL.
+    :param urls: URLs of the mirrors in priority order, followed by the public URL.
+    :type urls: list
+    :param headers: Request headers.
+    :type headers: dict
+    :return: (url, response)
+    :rtype: tuple
+    """
+    global logger
+
+    (mirror_urls, public_url) = (urls[:-1], urls[-1])
+    if mirror_urls:
+        if get_config_option("wrapper", "WRAPPER_MIRROR_RACE", True):
+            result = race_urls(mirror_urls, headers)
+            if result is not None:
+                return result
+        else:
+            for url in mirror_urls:
+                try:
+                    response = http_get(url, headers)
+                except get_interrupted_errors() as err2:
+                    logger.info(f'Mirror "{url}" failed: {err2}')
+                    continue
+                if is_usable_response(response):
+                    return url, response
+                logger.info(f'Mirror "{url}" returned status code {response.status_code}')
+                response.close()
+        logger.info(f'All mirrors failed. Downloading from "{public_url}"')
+    return public_url, http_get(public_url, headers)
+
+
+def race_urls(urls: list, headers: dict):
+    """
+    race_urls will send the request to all URLs at the same time and return the first usable response. The other
+    responses are closed as they arrive.
+    :param urls: URLs to race.
+    :type urls: list
+    :param headers: Request headers.
+    :type headers: dict
+    :return: (url, response) of the fastest URL, or None if all URLs failed.
+    :rtype: tuple
+    """
+    global logger
+    import concurrent.futures
+
+    start = time.perf_counter()
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=len(urls))
+    futures = {executor.submit(http_get, url, headers): url for url in urls}
+    winner = None
+    for future in concurrent.futures.as_completed(futures):
+        url = futures[future]
+        if future.exception() is not None:
+            logger.info(f'Mirror "{url}" failed: {future.exception()}')
+            continue
+        if is_usable_response(future.result()):
+            winner = future
+            break
+        logger.info(f'Mirror "{url}" returned status code {future.result().status_code}')
+
+    # Close the other responses, including the responses still in flight.
+    for future in futures:
+        if future is not winner:
+            future.add_done_callback(close_response)
+    executor.shutdown(wait=False)
+
+    if winner is None:
+        return None
+    logger.debug(f'Mirror "{futures[winner]}" responded first in {time.perf_counter() - start:.3f}s')
+    return futures[winner], winner.result()
+
+
+def is_usable_response(response) -> bool:
+    """
+    is_usable_response will check if the response can be used to download the file. 416 is usable because it's handled
+    by download_file().
+    :param response: The response.
+    :type response: requests.Response | UrllibResponse
+    :return: True if the response is usable; False otherwise
+    :rtype: bool
+    """
+    return response.status_code < 400 or response.status_code == 416
+
+
+def close_response(future) -> None:
+    """
+    close_response will close the response of a finished http_get() future.
+    :param future: Future returned by submitting http_get() to an executor.
+    :type future: concurrent.futures.Future
+    """
+    if not future.cancelled() and future.exception() is None:
+        future.result().close()
+
+
+def install_binary(binary_name: str) -> None:
+    """
+    install_binary will download the binary if it's not installed. The binary is downloaded while holding a host-wide
+    lock on the binary. Concurrent wrappers wait for the lock and then use the binary downloaded by the first wrapper
+    instead of downloading it again.
+    :param binary_name: Name of the binary.
+    :type binary_name: str
+    """
+    global logger, config
+
+    version = get_binary_version()
+    if version is not None:
+        deferred_bin_file = get_deferred_bin_file(binary_name, version)
+        if deferred_bin_file is not None:
+            config["bin_file"] = deferred_bin_file
+            return
+    if is_installed(binary_name) and (version is None or get_current_version(binary_name) == version):
+        return
+
+    lock_file = os.path.join(config["bin_dir"], f".{binary_name}.lock")
+    lock = acquire_lock(lock_file, get_config_option("wrapper", "WRAPPER_LOCK_TIMEOUT", 600))
+    try:
+        # Another wrapper may have installed the binary while this wrapper was waiting for the lock.
+        if is_installed(binary_name):
+            logger.info(f'Binary "{binary_name}" was installed by another process')
+        else:
+            # Only the wrapper holding the lock removes a binary, so a download in progress is never removed.
+            remove_binary(config["bin_file"])
+            download_binary(binary_name)
+        if version is not None:
+            set_current_version(binary_name, version)
+    finally:
+        release_lock(lock)
+
+
+def get_deferred_bin_file(binary_name: str, version: str):
+    """
+    get_deferred_bin_file will check if this host waits to upgrade to the version because of WRAPPER_ROLLOUT_WINDOW.
+    The host's offset in the window is computed from the hash of WRAPPER_AGENT_ID, the binary and the version, so the
+    hosts of a fleet are spread evenly over the window and each host gets the same offset on every run. The window
+    starts when the host first sees the version.
+    :param binary_name: Name of the binary.
+    :type binary_name: str
+    :param version: The version in WRAPPER_BINARY_VERSION.
+    :type version: str
+    :return: Full path to the binary of the current version if the upgrade is deferred; None otherwise.
+    :rtype: str
+    """
+    global logger, config
+
+    window = get_config_option("wrapper", "WRAPPER_ROLLOUT_WINDOW", 0)
+    if window <= 0 or get_config_option("wrapper", "WRAPPER_UPGRADE_URGENT", False):
+        return None
+    current_version = get_current_version(binary_name)
+    if current_version is None or current_version == version:
+        return None
+
+    agent_id = get_config_option("wrapper", "WRAPPER_AGENT_ID", platform.node())
+    digest = hashlib.sha256(f"{agent_id}:{binary_name}:{version}".encode("utf-8")).hexdigest()
+    offset = int(digest[:8], 16) / 0x100000000 * window
+    remaining = get_rollout_first_seen(binary_name, version) + offset - time.time()
+    if remaining <= 0:
+        return None
+
+    current_bin_file = os.path.join(get_versions_dir(binary_name), current_version,
+                                    os.path.basename(config["bin_file"]))
+    if not os.path.isfile(current_bin_file) or os.path.getsize(current_bin_file) == 0:
+        logger.info(f'Current version "{current_version}" is not installed in {os.path.dirname(current_bin_file)}')
+        return None
+    logger.info(f'Upgrade of "{binary_name}" from "{current_version}" to "{version}" starts in {remaining:.0f}s '
+                f'({offset:.0f}s into the {window}s rollout window). Running "{current_version}".')
+    return current_bin_file
+
+
+def get_rollout_first_seen(binary_name: str, version: str) -> float:
+    """
+    get_rollout_first_seen will return the time this host first saw the version, saving it in the rollout file if
+    the version is new.
+    :param binary_name: Name of the binary.
+    :type binary_name: str
+    :param version: The version in WRAPPER_BINARY_VERSION.
+    :type version: str
+    :return: The time (seconds since the epoch) the version was first seen.
+    :rtype: float
+    """
+    versions_dir = get_versions_dir(binary_name)
+    rollout_file = os.path.join(versions_dir, "rollout.json")
+    try:
+        with open(rollout_file, "r") as file:
+            rollout = json.load(file)
+        if rollout["version"] == version:
+            return float(rollout["first_seen"])
+    except (OSError, ValueError, KeyError, TypeError):
+        pass
+
+    first_seen = time.time()
+    (fd, part_file) = tempfile.mkstemp(dir=versions_dir, suffix=".part")
+    with os.fdopen(fd, "w") as file:
+        json.dump({"version": version, "first_seen": first_seen}, file)
+    os.replace(part_file, rollout_file)
+    return first_seen
+
+
+def get_binary_version() -> str:
+    """
+    get_binary_version will return the version of the binary from WRAPPER_BINARY_VERSION.
+    :return: The version of the binary, or None if the binary is not versioned.
+    :rtype: str
+    """
+    global logger
+    version = get_config_option("wrapper", "WRAPPER_BINARY_VERSION", "")
+    if version == "":
+        return None
+    if re.match(version_regex, version) is None:
+        logger.error(f'Invalid WRAPPER_BINARY_VERSION "{version}"')
+        raise ValueError(f'Invalid WRAPPER_BINARY_VERSION "{version}"')
+    return version
+
+
+def get_versions_dir(binary_name: str) -> str:
+    """
+    get_versions_dir will return the directory that holds the versions of the binary.
+    :param binary_name: Name of the binary.
+    :type binary_name: str
+    :return: Full path to the versions directory.
+    :rtype: str
+    """
+    global config
+    return os.path.join(config["bin_dir"], "versions", binary_name)
+
+
+def get_current_version(binary_name: str) -> str:
+    """
+    get_current_version will return the installed version of the binary from the "current" file.
+    :param binary_name: Name of the binary.
+    :type binary_name: str
+    :return: The installed version, or None if no version is installed.
+    :rtype: str
+    """
+    current_file = os.path.join(get_versions_dir(binary_name), "current")
+    try:
+        with open(current_file, "r") as file:
+            version = file.read().strip()
+    except OSError:
+        return None
+    if re.match(version_regex, version) is None:
+        return None
+    return version
+
+
+def set_current_version(binary_name: str, version: str) -> None:
+    """
+    set_current_version will make the version the installed version of the binary by replacing the "current" file
+    atomically. The time the previous version was replaced is saved as the modification time of its directory, and
+    versions replaced more than WRAPPER_VERSION_GRACE_DAYS ago are removed.
+    :param binary_name: Name of the binary.
+    :type binary_name: str
+    :param version: Version to make current.
+    :type version: str
+    """
+    global logger
+
+    versions_dir = get_versions_dir(binary_name)
+    previous_version = get_current_version(binary_name)
+    if previous_version == version:
+        return
+
+    current_file = os.path.join(versions_dir, "current")
+    (fd, part_file) = tempfile.mkstemp(dir=versions_dir, suffix=".part")
+    with os.fdopen(fd, "w") as file:
+        file.write(version)
+    os.replace(part_file, current_file)
+    logger.info(f'Switched "{binary_name}" from version "{previous_version}" to "{version}"')
+
+    if previous_version is not None and os.path.isdir(os.path.join(versions_dir, previous_version)):
+        # Mark when the previous version was replaced. This starts the grace period.
+        os.utime(os.path.join(versions_dir, previous_version))
+    remove_old_versions(binary_name)
+
+
+def remove_old_versions(binary_name: str) -> None:
+    """
+    remove_old_versions will remove the versions of the binary that were replaced more than
+    WRAPPER_VERSION_GRACE_DAYS ago. Versions that can't be removed, i.e. running executables on Windows, are removed
+    the next time.
+    :param binary_name: Name of the binary.
+    :type binary_name: str
+    """
+    global logger
+
+    versions_dir = get_versions_dir(binary_name)
+    current_version = get_current_version(binary_name)
+    grace_seconds = get_config_option("wrapper", "WRAPPER_VERSION_GRACE_DAYS", 7.0) * 86400
+    for entry in os.listdir(versions_dir):
+        version_dir = os.path.join(versions_dir, entry)
+        if entry == current_version or entry == get_binary_version() or not os.path.isdir(version_dir):
+            continue
+        if time.time() - os.path.getmtime(version_dir) > grace_seconds:
+            logger.info(f'Removing old version "{entry}" of "{binary_name}"')
+            shutil.rmtree(version_dir, ignore_errors=True)
+
+
+def download_delta(binary_name: str, urls: list, filename: str) -> bool:
+    """
+    download_delta will download the bsdiff patch from the current version of the binary to the new version and apply
+    it to the current binary, saving the new binary to filename. The SHA-256 hash and size of the new binary are
+    published next to the patch, <patch>.json, and the patched binary is checked against them. The patch is streamed
+    to a temporary file next to filename.
+    :param binary_name: Name of the binary.
+    :type binary_name: str
+    :param urls: URLs of the new version of the binary on the mirrors in priority order, followed by the public URL.
+    :type urls: list
+    :param filename: Filename (full path) to save the new binary.
+    :type filename: str
+    :return: True if the patch was applied and the new binary matches the hash; False if the patch, the hash or the
+        current binary is not available, the patch download failed or the new binary does not match the hash. The
+        full binary is downloaded if False is returned.
+    :rtype: bool
+    """
+    global logger
+
+    current_version = get_current_version(binary_name)
+    if current_version is None or current_version == get_binary_version():
+        return False
+    current_file = os.path.join(get_versions_dir(binary_name), current_version, os.path.basename(config["bin_file"]))
+    if not os.path.isfile(current_file):
+        return False
+    try:
+        import bsdiff4
+    except ImportError:
+        logger.info(f"WRAPPER_DELTA_UPDATES requires the bsdiff4 module. Downloading the full binary.")
+        return False
+
+    start = time.perf_counter()
+    patch_urls = [f"{url}.from-{current_version}.bsdiff" for url in urls]
+    url = patch_urls[-1]
+    expected = get_delta_target(patch_urls)
+    if expected is None:
+        return False
+
+    (fd, patch_file) = tempfile.mkstemp(dir=os.path.dirname(filename), suffix=".bsdiff")
+    try:
+        try:
+            with os.fdopen(fd, "wb") as file:
+                (url, response) = open_download(patch_urls, {})
+                with response:
+                    logger.debug(f"Status code: {response.status_code}")
+                    if not 200 <= response.status_code < 300:
+                        # The full download retries and waits for the server.
+                        logger.info(f'Patch "{url}" returned status code {response.status_code}. Downloading the full '
+                                    f'binary.')
+                        return False
+                    for chunk in response.iter_content(chunk_size=download_chunk_size):
+                        check_cancelled()
+                        file.write(chunk)
+        except get_interrupted_errors() as err2:
+            logger.info(f'Download of patch "{url}" failed: {err2}. Downloading the full binary.')
+            return False
+
+        try:
+            bsdiff4.file_patch(current_file, filename, patch_file)
+        except (ValueError, OSError, EOFError) as err:
+            logger.warning(f'Failed to apply the patch from "{url}": {err}. Downloading the full binary.')
+            try:
+                os.remove(filename)
+            except OSError:
+                pass
+            return False
+        size = os.path.getsize(filename)
+        if size != expected["size"] or hash_file(filename) != expected["sha256"]:
+            logger.warning(f'Binary patched from "{url}" does not match the published hash. Downloading the full '
+                           f'binary.')
+            try:
+                os.remove(filename)
+            except OSError:
+                pass
+            return False
+        logger.debug(f'Patched version "{current_version}" with {os.path.getsize(patch_file)} bytes from "{url}" to '
+                     f'{size} bytes in {time.perf_counter() - start:.2f}s')
+        return True
+    finally:
+        try:
+            os.remove(patch_file)
+        except OSError:
+            pass
+
+
+def get_delta_target(patch_urls: list):
+    """
+    get_delta_target will download the SHA-256 hash and size of the binary the patch creates, <patch>.json with
+    {"sha256": "<hex digest>", "size": <bytes>}. A patch without them is not used.
+    :param patch_urls: URLs of the patch on the mirrors in priority order, followed by the public URL.
+    :type patch_urls: list
+    :return: {"sha256": str, "size": int}, or None if the hash is not available.
+    :rtype: dict
+    """
+    global logger
+
+    url = f"{patch_urls[-1]}.json"
+    try:
+        (url, response) = open_download([f"{patch_url}.json" for patch_url in patch_urls], {})
+        with response:
+            if not 200 <= response.status_code < 300:
+                logger.debug(f'Patch hash "{url}" returned status code {response.status_code}. Not using the patch.')
+                return None
+            content = b"".join(response.iter_content(chunk_size=download_chunk_size))
+        target = json.loads(content)
+        return {"sha256": str(target["sha256"]).lower(), "size": int(target["size"])}
+    except get_interrupted_errors() as err2:
+        logger.info(f'Download of patch hash "{url}" failed: {err2}. Not using the patch.')
+    except (ValueError, KeyError, TypeError) as err2:
+        logger.warning(f'Patch hash "{url}" is not valid: {err2}. Not using the patch.')
+    return None
+
+
+def acquire_lock(lock_file: str, timeout: int):
+    """
+    acquire_lock will acquire an exclusive lock on lock_file that is shared by all processes on the host. The lock
+    is held by the open file and released by release_lock() or when the process exits.
+    :param lock_file: Full path to the lock file.
+    :type lock_file: str
+    :param timeout: Seconds to wait for the lock.
+    :type timeout: int
+    :return: The open lock file.
+    :rtype: typing.IO
+    """
+    global logger
+
+    file = open(lock_file, "a+")
+    start = time.perf_counter()
+    delay = 0.05
+    while True:
+        try:
+            lock_file_handle(file)
+            break
+        except OSError:
+            waited = time.perf_counter() - start
+            if cancel_event.is_set():
+                file.close()
+                check_cancelled()
+            if waited >= timeout:
+                file.close()
+                logger.error(f'Timed out after {waited:.1f}s waiting for lock "{lock_file}"')
+                raise TimeoutError(f'Timed out after {waited:.1f}s waiting for lock "{lock_file}"')
+            time.sleep(delay)
+            delay = min(delay * 2, 1.0)
+
+    waited = time.perf_counter() - start
+    if waited > 0.05:
+        logger.info(f'Waited {waited:.1f}s for lock "{lock_file}"')
+    return file
+
+
+def release_lock(file) -> None:
+    """
+    release_lock will release the lock acquired by acquire_lock().
+    :param file: The open lock file returned by acquire_lock().
+    :type file: typing.IO
+    """
+    try:
+        unlock_file_handle(file)
+    finally:
+        file.close()
+
+
+def lock_file_handle(file) -> None:
+    """
+    lock_file_handle will lock the open file without blocking. OSError is raised if the file is locked by another
+    process.
+    :param file: The open file to lock.
+    :type file: typing.IO
+    """
+    if get_os_name() == "windows":
+        import msvcrt
+        file.seek(0)
+        msvcrt.locking(file.fileno(), msvcrt.LK_NBLCK, 1)
+    else:
+        import fcntl
+        fcntl.flock(file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+
+
+def unlock_file_handle(file) -> None:
+    """
+    unlock_file_handle will unlock the file locked by lock_file_handle().
+    :param file: The open file to unlock.
+    :type file: typing.IO
+    """
+    if get_os_name() == "windows":
+        import msvcrt
+        file.seek(0)
+        msvcrt.locking(file.fileno(), msvcrt.LK_UNLCK, 1)
+    else:
+        import fcntl
+        fcntl.flock(file.fileno(), fcntl.LOCK_UN)
+
+
+def download_all(binary_name: str, script_url: str, download_func=None):
+    """
+    download_all will install the binary and download the script at the same time. If one fails, the other is
+    cancelled and ValueError is raised.
+    :param binary_name: Name of the binary.
+    :type binary_name: str
+    :param script_url: URL of the script, or None if the binary runs the script from the URL (i.e. Deno).
+    :type script_url: str
+    :param download_func: Function to download the script. Default: get_script_downloader()
+    :type download_func: callable
+    :return: The return value of download_func, or None if script_url is None.
+    :rtype: any
+    """
+    global logger
+
+    if script_url is None or is_installed(binary_name):
+        # Nothing to do at the same time. Don't start threads.
+        install_binary(binary_name)
+        if script_url is None:
+            return None
+        return (download_func or get_script_downloader())(script_url)
+
+    import concurrent.futures
+    start = time.perf_counter()
+    timings = {}
+    with concurrent.futures.ThreadPoolExecutor(max_workers=2) as executor:
+        binary_future = executor.submit(run_timed, timings, "binary", install_binary, binary_name)
+        futures = [binary_future]
+        script_future = None
+        if script_url is not None:
+            script_future = executor.submit(run_timed, timings, "script", download_func or get_script_downloader(),
+                                            script_url)
+            futures.append(script_future)
+        (done, pending) = concurrent.futures.wait(futures, return_when=concurrent.futures.FIRST_EXCEPTION)
+        if any(future.exception() is not None for future in done):
+            cancel_event.set()
+        concurrent.futures.wait(pending)
+    elapsed = time.perf_counter() - start
+
+    if binary_future.exception() is not None and not isinstance(binary_future.exception(), CancelledDownload):
+        logger.error(f'Failed to download the binary "{binary_name}": {binary_future.exception()}')
+        raise ValueError(f'Failed to download the binary "{binary_name}"')
+    if script_future is not None and script_future.exception() is not None:
+        logger.error(f'Failed to download the script from URL "{script_url}": {script_future.exception()}')
+        raise ValueError(f'Failed to download the script from URL "{script_url}"')
+    if binary_future.exception() is not None:
+        raise ValueError(f'Failed to download the binary "{binary_name}"')
+
+    logger.debug(f"Download timings: {', '.join(f'{name} {seconds:.3f}s' for name, seconds in timings.items())}; "
+                 f"wall {elapsed:.3f}s; saved {max(sum(timings.values()) - elapsed, 0):.3f}s")
+    if script_future is None:
+        return None
+    return script_future.result()
+
+
+def run_timed(timings: dict, name: str, func, *args):
+    """
+    run_timed will call func with args and save the elapsed time in timings[name].
+    :param timings: Dict to save the elapsed time.
+    :type timings: dict
+    :param name: Key in timings.
+    :type name: str
+    :param func: Function to call.
+    :type func: callable
+    :return: The return value of func.
+    :rtype: any
+    """
+    start = time.perf_counter()
+    try:
+        return func(*args)
+    finally:
+        timings[name] = time.perf_counter() - start
+
+
+class RetryLater(Exception):
+    """
+    RetryLater is raised when the server responds with 429 Too Many Requests or a 5xx server error.
+    """
+    def __init__(self, message: str, retry_after: float = None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+def check_retry_later(url: str, response) -> None:
+    """
+    check_retry_later will raise RetryLater if the server asked the wrapper to come back later (429) or failed with a
+    5xx server error (500, 502, 503, 504), with the seconds from the Retry-After header, if any. Retry-After is either
+    seconds or an HTTP date.
+    :param url: URL of the request.
+    :type url: str
+    :param response: The response.
+    :type response: requests.Response | UrllibResponse
+    """
+    if response.status_code != 429 and response.status_code < 500:
+        return
+    retry_after = None
+    value = response.headers.get("Retry-After")
+    if value is not None:
+        try:
+            retry_after = max(0.0, float(value))
+        except ValueError:
+            import email.utils
+            try:
+                retry_after = max(0.0, email.utils.parsedate_to_datetime(value).timestamp() - time.time())
+            except (TypeError, ValueError):
+                pass
+    raise RetryLater(f'"{url}" returned status code {response.status_code}, Retry-After: {value}', retry_after)
+
+
+def wait_before_retry(attempt: int, retry_after: float = None) -> None:
+    """
+    wait_before_retry will wait before the next download attempt. The wait doubles with each attempt (1s, 2s, 4s, ...)
+    up to WRAPPER_BACKOFF_MAX, and a random part of the wait is dropped so hosts that failed at the same time don't
+    retry at the same time. If the server sent Retry-After, that is used instead, with up to 10% jitter added.
+    :param attempt: Number of the attempt that failed, starting at 1.
+    :type attempt: int
+    :param retry_after: Seconds from the Retry-After header, if any.
+    :type retry_after: float
+    """
+    global logger
+    max_delay = get_config_option("wrapper", "WRAPPER_BACKOFF_MAX", 300.0)
+    if retry_after is not None:
+        delay = min(retry_after, max_delay) * random.uniform(1.0, 1.1)
+    else:
+        delay = min(2.0 ** (attempt - 1), max_delay)
+        delay = random.uniform(delay / 2, delay)
+    logger.info(f"Retrying the download in {delay:.1f}s")
+    # Wake up early if a concurrent download failed.
+    cancel_event.wait(delay)
+    check_cancelled()
+
+
+class CancelledDownload(Exception):
+    """
+    CancelledDownload is raised in a download that was cancelled because a concurrent download failed.
+    """
+    pass
+
+
+def check_cancelled() -> None:
+    """
+    check_cancelled will raise CancelledDownload if cancel_event is set.
+    """
+    if cancel_event.is_set():
+        raise CancelledDownload("Download cancelled because a concurrent download failed")
+
+
+def download_script(url: str, missing_ok: bool = False) -> str:
+    """
+    Download the script into the script cache in cache_dir and return the filename of the cached script. The ETag and
+    Last-Modified headers are saved alongside the script and used to revalidate the cache with a conditional request,
+    so an unchanged script costs a single "304 Not Modified". Scripts from an immutable version (see
+    is_immutable_url()) are served from the cache without a network request. The metadata records the fingerprint
+    of the script it belongs to. If concurrent runs leave a script with another run's metadata, the metadata is
+    ignored and the script is downloaded again. With missing_ok, a 404 is saved in the metadata and the URL is not
+    requested again for missing_cache_seconds, or at all if the URL is immutable.
+    :param url: URL of the script.
+    :type url: str
+    :param missing_ok: Return None instead of raising an error if the script does not exist (404).
+    :type missing_ok: bool
+    :return: Full path to the cached script.
+    :rtype: str
+    """
+    global logger, config
+
+    cache_key = hashlib.sha256(url.encode("utf-8")).hexdigest()
+    script_file = os.path.join(config["cache_dir"], f"{cache_key}{get_script_ext()}")
+    meta_file = os.path.join(config["cache_dir"], f"{cache_key}.json")
+
+    meta = {}
+    if os.path.isfile(meta_file):
+        try:
+            with open(meta_file, "r") as file:
+                meta = json.load(file)
+            if meta.get("missing"):
+                pass
+            elif not os.path.isfile(script_file) or meta.get("script") != get_stat_fingerprint(script_file):
+                logger.debug(f'Cache metadata "{meta_file}" does not belong to the cached script. Ignoring it.')
+                meta = {}
+        except (OSError, ValueError, AttributeError):
+            logger.warning(f'Ignoring unreadable cache metadata "{meta_file}"')
+            meta = {}
+
+    if meta.get("missing"):
+        if missing_ok and (is_immutable_url(url) or time.time() - meta.get("checked", 0) < missing_cache_seconds):
+            logger.debug(f'Script "{url}" does not exist (cached)')
+            return None
+        meta = {}
+
+    if meta and is_immutable_url(url):
+        logger.debug(f'Using cached script "{script_file}" for immutable URL "{url}"')
+        return script_file
+
+    headers = {}
+    if meta.get("etag"):
+        headers["If-None-Match"] = meta["etag"]
+    if meta.get("last_modified"):
+        headers["If-Modified-Since"] = meta["last_modified"]
+
+    try:
+        logger.debug(f'Downloading script from URL "{url}" to file "{script_file}"')
+        with http_get(url, headers) as response:
+            logger.debug(f"Status code: {response.status_code}")
+            if response.status_code == 304 and meta:
+                logger.debug(f'Script has not been modified. Using cached script "{script_file}"')
+                return script_file
+            if response.status_code == 404 and missing_ok:
+                logger.debug(f'Script "{url}" does not exist')
+                write_script_meta(meta_file, {"url": url, "missing": True, "checked": time.time()})
+                return None
+            response.raise_for_status()
+
+            # Write to a temporary file in the cache and rename it, so concurrent runs never see a partial script.
+            (fd, part_file) = tempfile.mkstemp(dir=config["cache_dir"], suffix=".part")
+            try:
+                with os.fdopen(fd, "wb") as file:
+                    for chunk in response.iter_content(chunk_size=download_chunk_size):
+                        check_cancelled()
+                        file.write(chunk)
+                # os.replace() keeps the inode and modification time, so the fingerprint matches the script.
+                meta = {
+                    "url": url,
+                    "etag": response.headers.get("ETag"),
+                    "last_modified": response.headers.get("Last-Modified"),
+                    "script": get_stat_fingerprint(part_file),
+                }
+                os.replace(part_file, script_file)
+            except:
+                os.remove(part_file)
+                raise
+
+            write_script_meta(meta_file, meta)
+        return script_file
+    except CancelledDownload:
+        logger.info(f'Download of script from URL "{url}" was cancelled')
+        raise
+    except:
+        logger.error(f'Failed to download script from URL "{url}"')
+        raise
+
+
+def write_script_meta(meta_file: str, meta: dict) -> None:
+    """
+    write_script_meta will write the metadata of a cached script through a temporary file, so concurrent runs never
+    see partial metadata.
+    :param meta_file: Full path to the metadata file.
+    :type meta_file: str
+    :param meta: The metadata.
+    :type meta: dict
+    """
+    global config
+    (fd, part_file) = tempfile.mkstemp(dir=config["cache_dir"], suffix=".part")
+    with os.fdopen(fd, "w") as file:
+        json.dump(meta, file)
+    os.replace(part_file, meta_file)
+
+
+def get_script_downloader():
+    """
+    get_script_downloader will return the function that downloads the script: download_bundle() if the script is a
+    Python bundle, download_script() otherwise.
+    :return: download_bundle or download_script
+    :rtype: callable
+    """
+    global config
+    if config["wrapper"]["WRAPPER_BINARY"] == "rustpython" and (
+        get_config_option("wrapper", "WRAPPER_BUNDLE_FILES", "") != ""
+        or get_config_option("wrapper", "WRAPPER_BUNDLE_IMPORTS", False)
+    ):
+        return download_bundle
+    return download_script
+
+
+def download_bundle(url: str) -> str:
+    """
+    download_bundle will download the Python script and the modules it uses from the same directory of the repo into
+    a bundle directory in the script cache, cache_dir/bundles/<hash of the directory URL>/. The modules are the files
+    in WRAPPER_BUNDLE_FILES and, if WRAPPER_BUNDLE_IMPORTS is true, the modules the script imports that exist next to
+    the script. The modules are downloaded at the same time, through the script cache. The script is run from the
+    bundle directory, so the interpreter puts the bundle directory first on the module path.
+    :param url: URL of the script.
+    :type url: str
+    :return: Full path to the script in the bundle directory.
+    :rtype: str
+    """
+    global logger, config
+    import concurrent.futures
+
+    start = time.perf_counter()
+    (base_url, script_name) = url.split("?", 1)[0].rsplit("/", 1)
+    bundle_dir = os.path.join(config["cache_dir"], "bundles",
+                              hashlib.sha256(base_url.encode("utf-8")).hexdigest()[:16])
+    resolve_imports = get_config_option("wrapper", "WRAPPER_BUNDLE_IMPORTS", False)
+    required = [name.strip() for name in get_config_option("wrapper", "WRAPPER_BUNDLE_FILES", "").split(",")]
+    required = [name for name in required if name != ""]
+    for name in required:
+        if name.startswith("/") or ".." in name.split("/"):
+            logger.error(f'Bundle file "{name}" must be a path relative to the script')
+            raise ValueError(f'Bundle file "{name}" must be a path relative to the script')
+
+    # Each job is the list of candidate paths of one file. The first path that exists is used.
+    jobs = [[script_name]] + [[name] for name in required]
+    seen = set(paths[0] for paths in jobs)
+    # Modules waiting for their package to be found in the repo.
+    waiting = []
+    found = set()
+    files = 0
+    with concurrent.futures.ThreadPoolExecutor(max_workers=8) as executor:
+        while jobs:
+            futures = {executor.submit(fetch_bundle_file, base_url, bundle_dir, paths, paths[0] in required
+                                       or paths[0] == script_name): paths for paths in jobs}
+            jobs = []
+            for future in concurrent.futures.as_completed(futures):
+                path = future.result()
+                if path is None:
+                    continue
+                files += 1
+                found.add(path)
+                if not resolve_imports or not path.endswith(".py"):
+                    continue
+                for (candidates, package_file) in get_bundle_imports(os.path.join(bundle_dir, path), path):
+                    if candidates[0] not in seen:
+                        seen.add(candidates[0])
+                        waiting.append((candidates, package_file))
+            # The modules in a package that is not in the repo are left waiting and are never looked for.
+            jobs = [candidates for (candidates, package_file) in waiting
+                    if package_file is None or package_file in found]
+            waiting = [(candidates, package_file) for (candidates, package_file) in waiting
+                       if package_file is not None and package_file not in found]
+
+    logger.debug(f'Downloaded bundle of {files} files to "{bundle_dir}" in {time.perf_counter() - start:.3f}s')
+    return os.path.join(bundle_dir, script_name)
+
+
+def fetch_bundle_file(base_url: str, bundle_dir: str, paths: list, required: bool) -> str:
+    """
+    fetch_bundle_file will download the first of the paths that exists through the script cache and copy it into the
+    bundle directory.
+    :param base_url: URL of the directory of the script.
+    :type base_url: str
+    :param bundle_dir: The bundle directory.
+    :type bundle_dir: str
+    :param paths: Candidate paths of the file relative to the script, i.e. ["util.py", "util/__init__.py"].
+    :type paths: list
+    :param required: Raise an error if none of the paths exist.
+    :type required: bool
+    :return: The path of the file that was downloaded, or None if none of the paths exist.
+    :rtype: str
+    """
+    global logger
+    for path in paths:
+        cached_file = download_script(f"{base_url}/{path}", missing_ok=True)
+        if cached_file is None:
+            continue
+        bundle_file = os.path.join(bundle_dir, *path.split("/"))
+        os.makedirs(os.path.dirname(bundle_file), exist_ok=True)
+        # Copy to a temporary file and rename it, so concurrent runs never see a partial module.
+        (fd, part_file) = tempfile.mkstemp(dir=os.path.dirname(bundle_file), suffix=".part")
+        os.close(fd)
+        shutil.copyfile(cached_file, part_file)
+        os.replace(part_file, bundle_file)
+        return path
+    if required:
+        logger.error(f'Bundle file "{base_url}/{paths[0]}" does not exist')
+        raise ValueError(f'Bundle file "{base_url}/{paths[0]}" does not exist')
+    logger.debug(f"Module {paths} is not in the repo. It's expected to be installed.")
+    return None
+
+
+def get_bundle_imports(module_file: str, module_path: str) -> list:
+    """
+    get_bundle_imports will return the modules imported by the Python module that may be in the repo, next to the
+    script. Modules in the standard library and modules installed for this interpreter are skipped. A module in a
+    package that is not known to exist, i.e. "name" in "from package import name", is returned with the
+    "__init__.py" of the package, and is only looked for if the package is in the repo.
+    :param module_file: Full path to the module.
+    :type module_file: str
+    :param module_path: Path of the module relative to the script, i.e. "lib/util.py".
+    :type module_path: str
+    :return: The candidate paths of each module and the package that has to exist first, or None, i.e.
+        [(["pkg.py", "pkg/__init__.py"], None), (["pkg/util.py", "pkg/util/__init__.py"], "pkg/__init__.py")].
+    :rtype: list
+    """
+    global logger
+    import ast
+    import importlib.util
+
+    try:
+        with open(module_file, "rb") as file:
+            tree = ast.parse(file.read(), filename=module_path)
+    except (SyntaxError, ValueError) as err2:
+        logger.warning(f'Not resolving the imports of "{module_path}": {err2}')
+        return []
+
+    # Relative imports are relative to the package of the module, the directory it's in.
+    package = module_path.split("/")[:-1]
+    # Each import is the parts of the module name and the number of leading parts known to exist.
+    imports = []
+    absolute = set()
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Import):
+            absolute.update(alias.name for alias in node.names)
+        elif isinstance(node, ast.ImportFrom) and node.level == 0 and node.module:
+            absolute.add(node.module)
+            # "from package import module"
+            absolute.update(f"{node.module}.{alias.name}" for alias in node.names if alias.name != "*")
+        elif isinstance(node, ast.ImportFrom):
+            if node.level - 1 > len(package):
+                continue
+            base = package[:len(package) - (node.level - 1)]
+            if node.module:
+                imports.append((base + node.module.split("."), len(base)))
+            for alias in node.names:
+                if alias.name != "*":
+                    imports.append((base + (node.module.split(".") if node.module else []) + [alias.name],
+                                    len(base)))
+
+    stdlib = getattr(sys, "stdlib_module_names", set())
+    for name in absolute:
+        top = name.split(".")[0]
+        if top in stdlib or top in sys.builtin_module_names:
+            continue
+        try:
+            if importlib.util.find_spec(top) is not None:
+                continue
+        except (ImportError, ValueError):
+            pass
+        imports.append((name.split("."), 0))
+
+    # The packages of a module are imported too. The module with the fewest known parts wins.
+    modules = {}
+    for (parts, known) in imports:
+        for end in range(known + 1, len(parts) + 1):
+            module = tuple(parts[:end])
+            modules[module] = min(modules.get(module, known), known)
+
+    candidates = []
+    for module in sorted(modules):
+        path = "/".join(module)
+        package_file = None
+        if len(module) - 1 > modules[module]:
+            package_file = "/".join(module[:-1]) + "/__init__.py"
+        candidates.append(([f"{path}.py", f"{path}/__init__.py"], package_file))
+    return candidates
+
+
+def download_script_content(url: str) -> bytes:
+    """
+    download_script_content will download the script into memory. The script is not written to disk.
+    :param url: URL of the script.
+    :type url: str
+    :return: The script.
+    :rtype: bytes
+    """
+    global logger
+
+    try:
+        logger.debug(f'Downloading script from URL "{url}" into memory')
+        with http_get(url) as response:
+            logger.debug(f"Status code: {response.status_code}")
+            response.raise_for_status()
+            content = bytearray()
+            for chunk in response.iter_content(chunk_size=download_chunk_size):
+                check_cancelled()
+                content.extend(chunk)
+        return bytes(content)
+    except CancelledDownload:
+        logger.info(f'Download of script from URL "{url}" was cancelled')
+        raise
+    except:
+        logger.error(f'Failed to download script from URL "{url}"')
+        raise
+
+
+def is_immutable_url(url: str) -> bool:
+    """
+    is_immutable_url will check if the URL is the script URL composed from WRAPPER_REMOTE_REPO,
+    WRAPPER_REMOTE_VERSION and WRAPPER_REMOTE_SCRIPT, or a file in the same directory of the repo (bundle modules), and
+    the version is a release tag. Other URLs, i.e. WRAPPER_DOWNLOAD_URL, are never immutable, even if they contain
+    the version.
+    :param url: URL of the script.
+    :type url: str
+    :return: True if the URL references an immutable release tag; False otherwise
+    :rtype: bool
+    """
+    global config
+    if (
+        "WRAPPER_REMOTE_REPO" not in config["wrapper"]
+        or "WRAPPER_REMOTE_VERSION" not in config["wrapper"]
+        or "WRAPPER_REMOTE_SCRIPT" not in config["wrapper"]
+    ):
+        return False
+    remote_version = config["wrapper"]["WRAPPER_REMOTE_VERSION"]
+    if re.match(immutable_version_regex, remote_version) is None:
+        return False
+    remote_repo = config["wrapper"]["WRAPPER_REMOTE_REPO"]
+    remote_script = config["wrapper"]["WRAPPER_REMOTE_SCRIPT"]
+    remote_url = f"{remote_repo}/{remote_version}/{remote_script}"
+    return url == remote_url or url.startswith(f'{remote_url.rsplit("/", 1)[0]}/')
+
+
+def exec_script(script: str, stdin_data: bytes = None, pass_fds: tuple = (), outputs: tuple = None) -> str:
+    """
+    Execute the script as a parameter to the binary.
+    :param script: Script to pass to the binary. "-" reads the script from stdin_data.
+    :type script: str
+    :param stdin_data: Data written to stdin of the binary.
+    :type stdin_data: bytes
+    :param pass_fds: File descriptors to keep open in the binary, i.e. for /dev/fd/N scripts.
+    :type pass_fds: tuple
+    :param outputs: Streams for stdout and stderr of the binary. Default: (sys.stdout, sys.stderr)
+    :type outputs: tuple
+    :return: Script output.
+    :rtype: str
+    """
+    global logger, config
+    # Run the script as a parameter to the binary.
+    # Note: binary is used to determine which binary to execute while bin_file is the full path to the binary that was
+    # determined earlier.
+    deno_compiled = None
+    if config["wrapper"]["WRAPPER_BINARY"] == "deno":
+        deno_compiled = get_deno_compiled(script)
+
+    if config["wrapper"]["WRAPPER_BINARY"] == "rustpython":
+        command = [config["bin_file"], script]
+    elif deno_compiled is not None:
+        # The compiled executable has the permission flags compiled in.
+        command = [deno_compiled]
+    elif config["wrapper"]["WRAPPER_BINARY"] == "deno":
+        command = [
+            config["bin_file"],
+            # Don't display the download progress output.
+            "--quiet",
+            "run",
+        ]
+        # Use EXEC_DENO_RUN_FLAGS=--reload to bypass the cache for development.
+        # For production, the version tag will force a new version to be downloaded.
+        if "EXEC_DENO_RUN_FLAGS" in config["exec"]:
+            command.extend(config["exec"]["EXEC_DENO_RUN_FLAGS"].split())
+        # Add deno run permission flags.
+        if "EXEC_DENO_PERMISSION_FLAGS" in config["exec"]:
+            command.extend(config["exec"]["EXEC_DENO_PERMISSION_FLAGS"].split())
+        if script == "-" or script.startswith("/dev/fd/"):
+            # Deno uses the file extension to determine the media type. In-memory scripts don't have an extension.
+            command.append(f"--ext={get_script_ext().lstrip('.')}")
+        command.append(script)
+    elif config["wrapper"]["WRAPPER_BINARY"] == "nushell":
+        command = [config["bin_file"], script]
+    else:
+        logger.error(f'Unknown binary "{config["wrapper"]["WRAPPER_BINARY"]}"')
+        raise ValueError(f'Unknown binary "{config["wrapper"]["WRAPPER_BINARY"]}"')
+
+    try:
+        logger.info(f'Executing "{command}"')
+        logger.info(f"Output from script:")
+        return run_command(command, stdin_data, pass_fds, outputs)
+    except subprocess.CalledProcessError as err2:
+        logger.error(f"Failed to exec: {command}")
+        logger.error(f"Return code: {err2.returncode}")
+        logger.error(f"Output (last lines): {err2.output}")
+        logger.error(f"Stderr (last lines): {err2.stderr}")
+        logger.error(traceback.format_exc())
+        logger.error(err2)
+        raise
+
+
+def get_deno_compiled(script: str) -> str:
+    """
+    get_deno_compiled will return the cached executable compiled from the Deno script, compiling it if necessary. The
+    executables are cached in compiled/<repo and script hash>/<version>-<build hash>/ in bin_dir, and the other builds
+    of the script are removed when a build is compiled. deno compile bakes the flags and the Deno runtime into the
+    executable, so the build hash covers EXEC_DENO_RUN_FLAGS, EXEC_DENO_PERMISSION_FLAGS and the hash of the deno
+    binary. Only scripts from an immutable version are compiled because the cache is not revalidated.
+    :param script: URL of the Deno script.
+    :type script: str
+    :return: Full path to the compiled executable, or None if the script is not compiled.
+    :rtype: str
+    """
+    global logger, config
+
+    if not get_config_option("wrapper", "WRAPPER_DENO_COMPILE", False):
+        return None
+    if "--reload" in config["exec"].get("EXEC_DENO_RUN_FLAGS", "").split():
+        logger.debug(f"EXEC_DENO_RUN_FLAGS has --reload. Not using the compiled executable.")
+        return None
+    if (
+        "WRAPPER_REMOTE_REPO" not in config["wrapper"]
+        or "WRAPPER_REMOTE_SCRIPT" not in config["wrapper"]
+        or not is_immutable_url(script)
+    ):
+        logger.debug(f'Not compiling "{script}" because it is not from a release tag in WRAPPER_REMOTE_VERSION')
+        return None
+
+    flags = []
+    if "EXEC_DENO_RUN_FLAGS" in config["exec"]:
+        flags.extend(config["exec"]["EXEC_DENO_RUN_FLAGS"].split())
+    if "EXEC_DENO_PERMISSION_FLAGS" in config["exec"]:
+        flags.extend(config["exec"]["EXEC_DENO_PERMISSION_FLAGS"].split())
+    build_key = json.dumps({"flags": flags, "deno": get_binary_hash(config["bin_file"])})
+    build_hash = hashlib.sha256(build_key.encode("utf-8")).hexdigest()[:16]
+
+    remote_key = f'{config["wrapper"]["WRAPPER_REMOTE_REPO"]}/{config["wrapper"]["WRAPPER_REMOTE_SCRIPT"]}'
+    remote_hash = hashlib.sha256(remote_key.encode("utf-8")).hexdigest()[:16]
+    script_dir = os.path.join(config["bin_dir"], "compiled", remote_hash)
+    build_name = f'{config["wrapper"]["WRAPPER_REMOTE_VERSION"]}-{build_hash}'
+    version_dir = os.path.join(script_dir, build_name)
+    (script_name, _) = os.path.splitext(os.path.basename(config["wrapper"]["WRAPPER_REMOTE_SCRIPT"]))
+    compiled_file = os.path.join(version_dir, f"{script_name}{get_exe_ext()}")
+    if os.path.isfile(compiled_file):
+        return compiled_file
+
+    if not os.path.isdir(version_dir):
+        os.makedirs(version_dir)
+    lock_timeout = get_config_option("wrapper", "WRAPPER_LOCK_TIMEOUT", 600)
+    lock = acquire_lock(os.path.join(script_dir, ".compile.lock"), lock_timeout)
+    try:
+        # Another wrapper may have compiled the script while this wrapper was waiting for the lock.
+        if os.path.isfile(compiled_file):
+            return compiled_file
+
+        # Compile to a temporary name and rename it, so other wrappers never run a partial executable.
+        part_file = os.path.join(version_dir, f"{script_name}.part{get_exe_ext()}")
+        command = [config["bin_file"], "compile", "--quiet", "--output", part_file, *flags, script]
+        logger.info(f'Compiling "{script}" with "{command}"')
+        start = time.perf_counter()
+        result = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+        if result.returncode != 0 or not os.path.isfile(part_file):
+            logger.warning(f'Failed to compile "{script}". Running it with "deno run" instead.')
+            logger.warning(f"Return code: {result.returncode}")
+            logger.warning(f"Output: {result.stdout}{result.stderr}")
+            if os.path.isfile(part_file):
+                os.remove(part_file)
+            return None
+        os.replace(part_file, compiled_file)
+        logger.debug(f'Compiled "{compiled_file}" in {time.perf_counter() - start:.2f}s')
+    finally:
+        release_lock(lock)
+
+    # Remove the executables compiled from other versions of the script or with other flags.
+    for entry in os.listdir(script_dir):
+        entry_dir = os.path.join(script_dir, entry)
+        if entry != build_name and os.path.isdir(entry_dir):
+            logger.info(f'Removing stale compiled script "{entry_dir}"')
+            shutil.rmtree(entry_dir, ignore_errors=True)
+    return compiled_file
+
+
+def set_deno_dir() -> None:
+    """
+    set_deno_dir will set DENO_DIR to deno-dir in bin_dir, so Deno's cache persists between runs. DENO_DIR is not
+    changed if it's already defined.
+    """
+    global logger, config
+    if "DENO_DIR" in os.environ:
+        logger.debug(f'Using existing DENO_DIR: "{os.environ["DENO_DIR"]}"')
+        return
+    os.environ["DENO_DIR"] = os.path.join(config["bin_dir"], "deno-dir")
+    logger.debug(f'DENO_DIR: "{os.environ["DENO_DIR"]}"')
+
+
+def get_in_memory_method() -> str:
+    """
+    get_in_memory_method will return how the script is passed to the binary without writing it to disk.
+    :return: "memfd" for an anonymous memory file, "stdin" for stdin, or None if the binary needs a file on disk.
+    :rtype: str
+    """
+    global config
+    if hasattr(os, "memfd_create") and os.path.isdir("/dev/fd"):
+        return "memfd"
+    if config["wrapper"]["WRAPPER_BINARY"] == "deno":
+        return "stdin"
+    return None
+
+
+def exec_script_in_memory(content: bytes) -> str:
+    """
+    exec_script_in_memory will execute the script held in memory without writing it to disk. See get_in_memory_method().
+    :param content: The script.
+    :type content: bytes
+    :return: Script output.
+    :rtype: str
+    """
+    global logger
+
+    method = get_in_memory_method()
+    if method == "memfd":
+        fd = os.memfd_create(f'script{get_script_ext()}')
+        try:
+            with os.fdopen(fd, "wb", closefd=False) as file:
+                file.write(content)
+            logger.debug(f"Passing the script to the binary in memory file /dev/fd/{fd}")
+            return exec_script(f"/dev/fd/{fd}", pass_fds=(fd,))
+        finally:
+            os.close(fd)
+    logger.debug(f"Passing the script to the binary on stdin")
+    return exec_script("-", stdin_data=content)
+
+
+def exec_script_in_process(script: str) -> None:
+    """
+    exec_script_in_process will run the Python script in this interpreter instead of passing it to the rustpython
+    binary. The script runs in a new __main__ namespace with sys.argv set to the script. sys.argv, sys.path, the
+    environment and the working directory are restored afterward, and the modules the script imported are removed
+    from sys.modules, so they don't affect the rest of the wrapper. The exit code is handled the same as exec_script(): a non-zero exit code
+    raises CalledProcessError.
+    :param script: Script to run.
+    :type script: str
+    """
+    global logger
+    import runpy
+
+    command = [sys.executable, script]
+    saved_argv = sys.argv[:]
+    saved_path = sys.path[:]
+    saved_environ = dict(os.environ)
+    saved_cwd = os.getcwd()
+    saved_modules = set(sys.modules)
+    return_code = 0
+
+    logger.info(f'Executing "{script}" in process')
+    logger.info(f"Output from script:")
+    sys.stdout.flush()
+    sys.stderr.flush()
+    start = time.perf_counter()
+    # Match the interpreter: the script directory is the first entry in sys.path.
+    sys.argv = [script]
+    sys.path.insert(0, os.path.dirname(script))
+    try:
+        runpy.run_path(script, run_name="__main__")
+    except SystemExit as err2:
+        # Map SystemExit to the exit code the same as the interpreter does.
+        if err2.code is None:
+            return_code = 0
+        elif isinstance(err2.code, int):
+            return_code = err2.code
+        else:
+            print(err2.code, file=sys.stderr)
+            return_code = 1
+    except Exception:
+        traceback.print_exc()
+        return_code = 1
+    finally:
+        sys.stdout.flush()
+        sys.stderr.flush()
+        sys.argv = saved_argv
+        sys.path[:] = saved_path
+        os.environ.clear()
+        os.environ.update(saved_environ)
+        os.chdir(saved_cwd)
+        for name in set(sys.modules) - saved_modules:
+            del sys.modules[name]
+    logger.debug(f"Script finished with return code {return_code} in {time.perf_counter() - start:.3f}s")
+
+    if return_code != 0:
+        logger.error(f"Failed to exec: {command}")
+        logger.error(f"Return code: {return_code}")
+        raise subprocess.CalledProcessError(return_code, command)
+
+
+def get_batch_urls() -> list:
+    """
+    get_batch_urls will return the script URLs from WRAPPER_BATCH_URLS and WRAPPER_BATCH_MANIFEST.
+    :return: Script URLs in the order they were listed. Empty if batch mode is not used.
+    :rtype: list
+    """
+    global logger, config
+
+    lines = config["wrapper"].get("WRAPPER_BATCH_URLS", "").replace(",", "\n").splitlines()
+    manifest = config["wrapper"].get("WRAPPER_BATCH_MANIFEST", "")
+    if manifest != "":
+        try:
+            if re.match(r"^[a-z]+://", manifest):
+                lines.extend(download_script_content(manifest).decode("utf-8").splitlines())
+            else:
+                with open(manifest, "r") as file:
+                    lines.extend(file.read().splitlines())
+        except:
+            logger.error(f'Failed to read the batch manifest "{manifest}"')
+            logger.error(traceback.format_exc())
+            raise
+    return [line.strip() for line in lines if line.strip() != "" and not line.strip().startswith("#")]
+
+
+def run_batch(urls: list) -> list:
+    """
+    run_batch will install the binary once and run the scripts on a pool of WRAPPER_BATCH_WORKERS threads. Each
+    script is downloaded while the binary is installed. The output of each script is printed as one block when the
+    script finishes, followed by a summary of all the scripts.
+    :param urls: URLs of the scripts to run.
+    :type urls: list
+    :return: The result of each script, in the order of urls. See run_batch_script().
+    :rtype: list
+    """
+    global logger, config
+    import concurrent.futures
+
+    workers = max(1, get_config_option("wrapper", "WRAPPER_BATCH_WORKERS", 4))
+    start = time.perf_counter()
+    output_lock = threading.Lock()
+    logger.info(f"Running {len(urls)} scripts with {workers} workers")
+    # One extra worker installs the binary, so it doesn't hold up the script downloads.
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers + 1) as executor:
+        binary_future = executor.submit(install_binary, config["wrapper"]["WRAPPER_BINARY"])
+        futures = [
+            executor.submit(run_batch_script, index, len(urls), url, binary_future, output_lock)
+            for index, url in enumerate(urls)
+        ]
+        results = [future.result() for future in futures]
+    elapsed = time.perf_counter() - start
+
+    failed = [result for result in results if result["return_code"] != 0]
+    print(f"Batch summary: {len(results) - len(failed)} of {len(results)} scripts succeeded in {elapsed:.2f}s")
+    for result in results:
+        status = "OK" if result["return_code"] == 0 else "FAIL"
+        print(f'  {status:<4} exit={result["return_code"]:<3} download={result["download"]:.2f}s '
+              f'exec={result["exec"]:.2f}s {result["url"]}')
+    sys.stdout.flush()
+    return results
+
+
+def run_batch_script(index: int, count: int, url: str, binary_future, output_lock: threading.Lock) -> dict:
+    """
+    run_batch_script will download and run one script of the batch, collecting its output, and print the output as
+    one block. stdout and stderr are kept in memory up to 1 MiB and in temporary files beyond that.
+    :param index: Index of the script in the batch.
+    :type index: int
+    :param count: Number of scripts in the batch.
+    :type count: int
+    :param url: URL of the script.
+    :type url: str
+    :param binary_future: Future of the binary install. The script is run after the binary is installed.
+    :type binary_future: concurrent.futures.Future
+    :param output_lock: Lock to print the output blocks one at a time.
+    :type output_lock: threading.Lock
+    :return: The result of the script: url, return_code, download and exec times in seconds, and error.
+    :rtype: dict
+    """
+    global logger
 
-    # tmp_file references a randomly generated directory.
-    # Note: The initial value is the system tmp directory. It's assigned a random file in set_tmp_file().
-    "tmp_file": None,
+    result = {"url": url, "return_code": 0, "download": 0.0, "exec": 0.0, "error": None}
+    stdout = tempfile.SpooledTemporaryFile(max_size=1048576, mode="w+", encoding="utf-8")
+    stderr = tempfile.SpooledTemporaryFile(max_size=1048576, mode="w+", encoding="utf-8")
+    with stdout, stderr:
+        start = time.perf_counter()
+        exec_start = None
+        try:
+            script = get_script_downloader()(url)
+            result["download"] = time.perf_counter() - start
+            binary_future.result()
+            exec_start = time.perf_counter()
+            exec_script(script, outputs=(stdout, stderr))
+            label_resource_usage(url, script)
+        except subprocess.CalledProcessError as err2:
+            label_resource_usage(url, script)
+            result["return_code"] = err2.returncode
+        except Exception as err2:
+            # Download and install errors don't have a return code.
+            logger.error(f'Failed to run the batch script "{url}": {err2}')
+            result["return_code"] = -1
+            result["error"] = str(err2)
+        if exec_start is not None:
+            result["exec"] = time.perf_counter() - exec_start
+
+        with output_lock:
+            print(f"===== [{index + 1}/{count}] {url} =====")
+            sys.stdout.flush()
+            stdout.seek(0)
+            shutil.copyfileobj(stdout, sys.stdout)
+            if stderr.tell() > 0:
+                print(f"----- stderr -----")
+                stderr.seek(0)
+                shutil.copyfileobj(stderr, sys.stdout)
+            if result["error"] is not None:
+                print(f'Error: {result["error"]}')
+            print(f'===== [{index + 1}/{count}] exit={result["return_code"]} download={result["download"]:.2f}s '
+                  f'exec={result["exec"]:.2f}s =====')
+            sys.stdout.flush()
+    return result
+
+
+def run_command(command: list, stdin_data: bytes = None, pass_fds: tuple = (), outputs: tuple = None) -> str:
+    """
+    run_command will run the command and forward its stdout and stderr line by line as the lines arrive. Only the last
+    WRAPPER_OUTPUT_TAIL_LINES lines of each stream are kept in memory, so the memory used does not depend on the
+    amount of output.
+    :param command: Command and arguments to run.
+    :type command: list
+    :param stdin_data: Data written to stdin of the command. If None, stdin is inherited.
+    :type stdin_data: bytes
+    :param pass_fds: File descriptors to keep open in the command.
+    :type pass_fds: tuple
+    :param outputs: Streams to forward stdout and stderr to. Default: (sys.stdout, sys.stderr)
+    :type outputs: tuple
+    :return: The last lines of stdout.
+    :rtype: str
+    """
+    global logger
 
-    # bin_dir is the directory that holds the binaries.
-    "bin_dir": None,
+    (stdout, stderr) = outputs or (sys.stdout, sys.stderr)
+    tail_lines = get_config_option("wrapper", "WRAPPER_OUTPUT_TAIL_LINES", 100)
+    stdout_tail = collections.deque(maxlen=tail_lines)
+    stderr_tail = collections.deque(maxlen=tail_lines)
+    first_output = []
+    stdout_bytes = [0]
+    stderr_bytes = [0]
+
+    # Flush anything already written, so it's not reordered with the output of the script.
+    sys.stdout.flush()
+    sys.stderr.flush()
+
+    wait_start = time.perf_counter()
+    slot = acquire_exec_slot()
+    start = time.perf_counter()
+    try:
+        (limited_command, late_options) = get_limited_command(command)
+        process = subprocess.Popen(
+            limited_command,
+            stdin=subprocess.PIPE if stdin_data is not None else None,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            pass_fds=pass_fds,
+        )
+        set_process_limits(process, late_options)
+        threads = [
+            threading.Thread(target=forward_output,
+                             args=(process.stdout, stdout, stdout_tail, first_output, stdout_bytes)),
+            threading.Thread(target=forward_output,
+                             args=(process.stderr, stderr, stderr_tail, first_output, stderr_bytes)),
+        ]
+        if stdin_data is not None:
+            threads.append(threading.Thread(target=write_input, args=(process.stdin, stdin_data)))
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        (return_code, usage) = wait_process(process)
+    finally:
+        release_exec_slot(slot)
+    elapsed = time.perf_counter() - start
+
+    if first_output:
+        logger.debug(f"Time to first output: {min(first_output) - start:.3f}s")
+    logger.debug(f"Script finished with return code {return_code} in {elapsed:.3f}s")
+
+    usage = {
+        "script": command[-1],
+        "return_code": return_code,
+        "slot_wait_seconds": round(start - wait_start, 3),
+        "wall_seconds": round(elapsed, 3),
+        "user_seconds": round(usage.get("user_seconds", 0.0), 3),
+        "system_seconds": round(usage.get("system_seconds", 0.0), 3),
+        "peak_rss_bytes": usage.get("peak_rss_bytes", 0),
+        "stdout_bytes": stdout_bytes[0],
+        "stderr_bytes": stderr_bytes[0],
+    }
+    logger.debug(f"Resource usage: {usage}")
+    with resource_usage_lock:
+        resource_usage.append(usage)
 
-    # bin_file is the full path to the binary.
-    "bin_file": None,
-}
+    output = "".join(stdout_tail)
+    if return_code != 0:
+        raise subprocess.CalledProcessError(return_code, command, output=output, stderr="".join(stderr_tail))
+    return output
 
-def download_binary(binary_name: str) -> None:
+
+def acquire_exec_slot():
     """
-    Download the binary and copy it to bin_file.
+    acquire_exec_slot will wait until fewer than WRAPPER_MAX_CONCURRENT binaries are running on the host. Each run
+    creates a ticket in WRAPPER_BIN_DIR/.exec-slots named after the time it arrived and keeps the ticket locked while
+    it waits and runs. A run starts when fewer than WRAPPER_MAX_CONCURRENT locked tickets are older than its ticket, so
+    runs start in the order they arrived. Tickets that are not locked were left by a wrapper that died and are removed.
+    The ticket is created and locked under a temporary name and renamed, so other runs never see an unlocked ticket
+    of a live run. Windows can't rename an open file; the ticket is created in place and locking is retried while
+    another run checks it.
+    :return: The locked ticket to pass to release_exec_slot(), or None if WRAPPER_MAX_CONCURRENT is not set.
+    :rtype: tuple
     """
     global logger, config
 
-    url = get_download_url(binary_name)
-    if url is None:
+    max_concurrent = get_config_option("wrapper", "WRAPPER_MAX_CONCURRENT", 0)
+    if max_concurrent <= 0:
         return None
 
+    slots_dir = os.path.join(config["bin_dir"], ".exec-slots")
+    os.makedirs(slots_dir, exist_ok=True)
+    ticket_name = f"{time.time_ns():020d}-{os.getpid()}-{threading.get_ident()}.ticket"
+    ticket_file = os.path.join(slots_dir, ticket_name)
+    if get_os_name() == "windows":
+        file = open(ticket_file, "a+")
+        # Another run may hold the lock for a moment while it checks the ticket.
+        for attempt in range(100):
+            try:
+                lock_file_handle(file)
+                break
+            except OSError:
+                if attempt == 99:
+                    file.close()
+                    os.remove(ticket_file)
+                    raise
+                time.sleep(0.01)
+    else:
+        # The temporary name does not end with ".ticket", so other runs ignore it until it's locked.
+        file = open(f"{ticket_file}.tmp", "a+")
+        lock_file_handle(file)
+        os.rename(f"{ticket_file}.tmp", ticket_file)
+    file.write(f"{os.getpid()}\n")
+    file.flush()
+
+    start = time.perf_counter()
+    delay = 0.05
     try:
-        logger.debug(f'Downloading binary from URL "{url}" to file "{config["bin_file"]}"')
-        response = requests.get(url, stream=True)
-        logger.debug(f"Status code: {response.status_code}")
-        file = open(config["bin_file"], "wb")
-        file.write(response.content)
-        file.close()
-        response.close()
-        os.chmod(config["bin_file"], 0o755)
-    except PermissionError as err2:
-        logger.error(f'PermissionError({err2.errno}): "{err2.strerror}" writing to file "{config["bin_file"]}"')
-        raise
+        while True:
+            ahead = [
+                name for name in sorted(os.listdir(slots_dir))
+                if name.endswith(".ticket") and name < ticket_name and is_ticket_live(os.path.join(slots_dir, name))
+            ]
+            if len(ahead) < max_concurrent:
+                break
+            # Listing the tickets is cheap. A short delay lets the next run start soon after a slot is free.
+            time.sleep(delay)
+            delay = min(delay * 2, 0.25)
     except:
-        logger.error(f'Failed to download binary from URL "{url}"')
-        logger.error(traceback.format_exc())
-        logger.error(sys.exc_info()[0])
+        release_exec_slot((file, ticket_file))
         raise
 
+    waited = time.perf_counter() - start
+    if waited > 0.05:
+        logger.info(f"Waited {waited:.1f}s for one of {max_concurrent} slots (WRAPPER_MAX_CONCURRENT)")
+    return file, ticket_file
+
 
-def download_script(url: str) -> str:
+def is_ticket_live(ticket_file: str) -> bool:
     """
-    Download the script to tmp_file.
+    is_ticket_live will check if the ticket is locked by a running wrapper. Tickets that can be locked are stale and
+    are removed. The ticket is opened without creating it, so a ticket that was just released is not recreated.
+    :param ticket_file: Full path to the ticket.
+    :type ticket_file: str
+    :return: True if the ticket is held by a running wrapper.
+    :rtype: bool
     """
-    global logger, config
+    global logger
+    try:
+        file = os.fdopen(os.open(ticket_file, os.O_RDWR), "r+")
+    except OSError:
+        # The ticket was released.
+        return False
+    try:
+        lock_file_handle(file)
+    except OSError:
+        file.close()
+        return True
 
     try:
-        logger.debug(f'Downloading script from URL "{url}" to file "{config["tmp_file"]}"')
-        response = requests.get(url, stream=True)
-        logger.debug(f"Status code: {response.status_code}")
-        file = open(config["tmp_file"], "wb")
-        file.write(response.content)
+        logger.debug(f'Removing stale ticket "{ticket_file}"')
+        unlock_file_handle(file)
         file.close()
-        response.close()
-        return config["tmp_file"]
-    except:
-        logger.error(f'Failed to download binary from URL "{url}"')
-        raise
+        os.remove(ticket_file)
+    except OSError:
+        pass
+    finally:
+        file.close()
+    return False
 
 
-def exec_script(script: str) -> str:
+def release_exec_slot(slot) -> None:
     """
-    Execute the script as a parameter to the binary.
-    :param script: Script to pass to the binary.
-    :type script: str
-    :return: Script output.
-    :rtype: str
+    release_exec_slot will remove the ticket acquired by acquire_exec_slot(), so the next run can start.
+    :param slot: The ticket returned by acquire_exec_slot().
+    :type slot: tuple
+    """
+    if slot is None:
+        return
+    (file, ticket_file) = slot
+    try:
+        release_lock(file)
+    finally:
+        try:
+            os.remove(ticket_file)
+        except OSError:
+            pass
+
+
+def get_limited_command(command: list) -> tuple:
+    """
+    get_limited_command will prefix the command with the tools that apply the priority, affinity and resource limits
+    in the EXEC_* options before the binary starts: nice, ionice, taskset and prlimit. preexec_fn is not used because
+    it's not safe with threads. The options that can't be applied by a tool, i.e. on Windows or if the tool is not
+    installed, are returned to be applied by set_process_limits() after the process starts.
+    :param command: Command and arguments to run.
+    :type command: list
+    :return: (command, options) where options are the EXEC_* options to apply after the process starts.
+    :rtype: tuple
     """
     global logger, config
-    # Run the script as a parameter to the binary.
-    # Note: binary is used to determine which binary to execute while bin_file is the full path to the binary that was
-    # determined earlier.
-    if config["wrapper"]["WRAPPER_BINARY"] == "rustpython":
-        command = [config["bin_file"], script]
-    elif config["wrapper"]["WRAPPER_BINARY"] == "deno":
-        command = [
-            config["bin_file"],
-            # Don't display the download progress output.
-            "--quiet",
-            "run",
-        ]
-        # Use EXEC_DENO_RUN_FLAGS=--reload to bypass the cache for development.
-        # For production, the version tag will force a new version to be downloaded.
-        if "EXEC_DENO_RUN_FLAGS" in config["exec"]:
-            command.extend(config["exec"]["EXEC_DENO_RUN_FLAGS"].split())
-        # Add deno run permission flags.
-        if "EXEC_DENO_PERMISSION_FLAGS" in config["exec"]:
-            command.extend(config["exec"]["EXEC_DENO_PERMISSION_FLAGS"].split())
-        command.append(script)
-    elif config["wrapper"]["WRAPPER_BINARY"] == "nushell":
-        command = [config["bin_file"], script]
+
+    os_name = get_os_name()
+    options = {
+        key: config["exec"][key]
+        for key in ("EXEC_NICE", "EXEC_IO_CLASS", "EXEC_CPU_AFFINITY", "EXEC_CPU_LIMIT", "EXEC_MEMORY_LIMIT")
+        if config["exec"].get(key, "") != ""
+    }
+    if os_name not in ("linux", "darwin") or not options:
+        return command, options
+
+    prefix = []
+    late_options = {}
+    prlimit_args = []
+    for key in options:
+        try:
+            if key == "EXEC_NICE":
+                tool = ["nice", "-n", str(get_config_option("exec", key, 0) - os.getpriority(os.PRIO_PROCESS, 0))]
+            elif os_name != "linux":
+                late_options[key] = options[key]
+                continue
+            elif key == "EXEC_IO_CLASS":
+                io_level = get_config_option("exec", "EXEC_IO_LEVEL", 4)
+                # Validate the class and level the same way set_process_io_priority() does.
+                if options[key] not in ("best-effort", "idle") or not 0 <= io_level <= 7:
+                    raise ValueError(f'Invalid IO class "{options[key]}" or IO level {io_level}')
+                tool = ["ionice", "-c", "3"] if options[key] == "idle" else ["ionice", "-c", "2", "-n", str(io_level)]
+            elif key == "EXEC_CPU_AFFINITY":
+                tool = ["taskset", "-c", ",".join(str(cpu) for cpu in sorted(get_affinity_cpus(options[key])))]
+            else:
+                limit = get_config_option("exec", key, 0)
+                if limit <= 0:
+                    raise ValueError(f"{key} must be a positive integer")
+                if key == "EXEC_CPU_LIMIT":
+                    # SIGXCPU at the soft limit and SIGKILL at the hard limit.
+                    prlimit_args.append(f"--cpu={limit}:{limit + 5}")
+                else:
+                    prlimit_args.append(f"--data={limit * 1048576}:{limit * 1048576}")
+                continue
+        except ValueError as err2:
+            logger.warning(f'Failed to set {key}="{options[key]}": {err2}')
+            continue
+        if shutil.which(tool[0]) is None:
+            logger.warning(f'"{tool[0]}" is not installed. Applying {key} after the binary starts.')
+            late_options[key] = options[key]
+            continue
+        prefix.extend(tool)
+
+    if prlimit_args:
+        if shutil.which("prlimit") is None:
+            logger.warning(f'"prlimit" is not installed. Applying the resource limits after the binary starts.')
+            for key in ("EXEC_CPU_LIMIT", "EXEC_MEMORY_LIMIT"):
+                if key in options:
+                    late_options[key] = options[key]
+        else:
+            prefix.extend(["prlimit", *prlimit_args, "--"])
+
+    if prefix:
+        logger.debug(f"Applying EXEC_* options with {prefix}")
+    return [*prefix, *command], late_options
+
+
+def set_process_limits(process: subprocess.Popen, options: dict) -> None:
+    """
+    set_process_limits will apply the priority, affinity and resource limits in the EXEC_* options to the process
+    after it starts. This is used on Windows and when get_limited_command() can't apply the options before the binary
+    starts. On Linux, the nice level, IO priority and affinity are per thread, so they are applied to every thread of
+    the process. Failures are logged and the process continues without the option.
+    :param process: The process of the binary.
+    :type process: subprocess.Popen
+    :param options: The EXEC_* options to apply. See get_limited_command().
+    :type options: dict
+    """
+    global logger, config
+
+    os_name = get_os_name()
+    for key in options:
+        try:
+            if key == "EXEC_NICE":
+                set_process_nice(process, get_config_option("exec", key, 0))
+            elif key == "EXEC_IO_CLASS":
+                for thread_id in get_thread_ids(process.pid):
+                    set_process_io_priority(thread_id, options[key], get_config_option("exec", "EXEC_IO_LEVEL", 4))
+            elif key == "EXEC_CPU_AFFINITY":
+                set_process_affinity(process, options[key])
+            elif os_name == "linux":
+                import resource
+                limit = get_config_option("exec", key, 0)
+                if limit <= 0:
+                    raise ValueError(f"{key} must be a positive integer")
+                if key == "EXEC_CPU_LIMIT":
+                    # SIGXCPU at the soft limit and SIGKILL at the hard limit.
+                    resource.prlimit(process.pid, resource.RLIMIT_CPU, (limit, limit + 5))
+                else:
+                    resource.prlimit(process.pid, resource.RLIMIT_DATA, (limit * 1048576, limit * 1048576))
+            else:
+                logger.warning(f"{key} is not supported on {os_name}")
+                continue
+            logger.debug(f'Set {key}="{options[key]}" on process {process.pid}')
+        except (OSError, ValueError, ImportError, AttributeError) as err2:
+            # The process may have exited already, or the option is not allowed or not supported.
+            logger.warning(f'Failed to set {key}="{options[key]}" on process {process.pid}: {err2}')
+
+
+def set_process_nice(process: subprocess.Popen, nice: int) -> None:
+    """
+    set_process_nice will set the nice level of the process. On Windows, the nice level is mapped to a priority class.
+    :param process: The process of the binary.
+    :type process: subprocess.Popen
+    :param nice: Nice level from -20 to 19.
+    :type nice: int
+    """
+    if get_os_name() != "windows":
+        for thread_id in get_thread_ids(process.pid):
+            os.setpriority(os.PRIO_PROCESS, thread_id, nice)
+        return
+
+    import ctypes
+    if nice >= 15:
+        priority_class = 0x00000040  # IDLE_PRIORITY_CLASS
+    elif nice >= 5:
+        priority_class = 0x00004000  # BELOW_NORMAL_PRIORITY_CLASS
+    elif nice <= -15:
+        priority_class = 0x00000080  # HIGH_PRIORITY_CLASS
+    elif nice <= -5:
+        priority_class = 0x00008000  # ABOVE_NORMAL_PRIORITY_CLASS
     else:
-        logger.error(f'Unknown binary "{config["wrapper"]["WRAPPER_BINARY"]}"')
-        raise ValueError(f'Unknown binary "{config["wrapper"]["WRAPPER_BINARY"]}"')
+        priority_class = 0x00000020  # NORMAL_PRIORITY_CLASS
+    if not ctypes.windll.kernel32.SetPriorityClass(ctypes.c_void_p(int(process._handle)), priority_class):
+        raise ctypes.WinError()
+
 
+def set_process_io_priority(pid: int, io_class: str, io_level: int) -> None:
+    """
+    set_process_io_priority will set the IO scheduling class and level of the process with the ioprio_set() system
+    call. Linux only.
+    :param pid: Process ID.
+    :type pid: int
+    :param io_class: IO scheduling class, 'idle' or 'best-effort'.
+    :type io_class: str
+    :param io_level: IO priority from 0 to 7 in the 'best-effort' class.
+    :type io_level: int
+    """
+    io_classes = {"best-effort": 2, "idle": 3}
+    if io_class not in io_classes:
+        raise ValueError(f'Unknown IO class "{io_class}". Use one of {list(io_classes)}')
+    if not 0 <= io_level <= 7:
+        raise ValueError(f"IO level {io_level} is not between 0 and 7")
+    syscall_number = ioprio_syscalls.get(platform.machine().lower())
+    if get_os_name() != "linux" or syscall_number is None:
+        raise OSError(f"ioprio_set() is not supported on {get_os_name()} {platform.machine()}")
+
+    import ctypes
+    libc = ctypes.CDLL(None, use_errno=True)
+    # IOPRIO_WHO_PROCESS is 1. The class is in the top 3 bits of the 16-bit priority.
+    io_priority = (io_classes[io_class] << 13) | (io_level if io_class == "best-effort" else 0)
+    if libc.syscall(syscall_number, 1, pid, io_priority) != 0:
+        errno = ctypes.get_errno()
+        raise OSError(errno, os.strerror(errno))
+
+
+def get_thread_ids(pid: int) -> list:
+    """
+    get_thread_ids will return the IDs of the threads of the process. On Linux, the nice level, IO priority and
+    affinity set by process ID only apply to the main thread.
+    :param pid: Process ID.
+    :type pid: int
+    :return: The thread IDs, or the process ID if the threads can't be listed.
+    :rtype: list
+    """
     try:
-        logger.info(f'Executing "{command}"')
-        # FIXME: Capture stderr in addition to stdout.
-        output = subprocess.check_output(
-            command, stderr=subprocess.STDOUT, universal_newlines=True
-        )
-        logger.info(f"Output from script:")
-        print(output)
-        return output
-    except subprocess.CalledProcessError as err2:
-        logger.error(f"Failed to exec: {command}")
-        logger.error(f"Return code: {err2.returncode}")
-        logger.error(f"Output: {err2.output}")
-        logger.error(traceback.format_exc())
-        logger.error(err2)
-        raise
+        return [int(thread_id) for thread_id in os.listdir(f"/proc/{pid}/task")]
+    except (OSError, ValueError):
+        return [pid]
+
+
+def set_process_affinity(process: subprocess.Popen, affinity: str) -> None:
+    """
+    set_process_affinity will pin the process to the CPUs. Linux and Windows only.
+    :param process: The process of the binary.
+    :type process: subprocess.Popen
+    :param affinity: 'first', 'last', or a comma separated list of CPUs and ranges, i.e. '0,2-3'.
+    :type affinity: str
+    """
+    cpus = get_affinity_cpus(affinity)
+    if hasattr(os, "sched_setaffinity"):
+        for thread_id in get_thread_ids(process.pid):
+            os.sched_setaffinity(thread_id, cpus)
+    elif get_os_name() == "windows":
+        import ctypes
+        mask = sum(1 << cpu for cpu in cpus)
+        if not ctypes.windll.kernel32.SetProcessAffinityMask(ctypes.c_void_p(int(process._handle)),
+                                                             ctypes.c_size_t(mask)):
+            raise ctypes.WinError()
+    else:
+        raise OSError(f"CPU affinity is not supported on {get_os_name()}")
+
+
+def get_affinity_cpus(affinity: str) -> set:
+    """
+    get_affinity_cpus will return the CPUs in EXEC_CPU_AFFINITY.
+    :param affinity: 'first', 'last', or a comma separated list of CPUs and ranges, i.e. '0,2-3'.
+    :type affinity: str
+    :return: The CPU numbers.
+    :rtype: set
+    """
+    if hasattr(os, "sched_getaffinity"):
+        available = sorted(os.sched_getaffinity(0))
+    else:
+        available = list(range(os.cpu_count() or 1))
+
+    if affinity == "first":
+        cpus = {available[0]}
+    elif affinity == "last":
+        cpus = {available[-1]}
+    else:
+        cpus = set()
+        for part in affinity.split(","):
+            (first, _, last) = part.strip().partition("-")
+            cpus.update(range(int(first), int(last or first) + 1))
+        if not cpus.issubset(available):
+            raise ValueError(f"CPUs {sorted(cpus - set(available))} are not available")
+    return cpus
+
+
+def wait_process(process: subprocess.Popen) -> tuple:
+    """
+    wait_process will wait for the process to exit and return its exit code and the resources it used. os.wait4()
+    returns the resources of the process itself, so processes running at the same time (i.e. batch mode) are measured
+    separately. Without os.wait4(), the difference of RUSAGE_CHILDREN is used. On Windows, the times and peak working
+    set are read from the process handle.
+    :param process: The process to wait for.
+    :type process: subprocess.Popen
+    :return: The exit code and a dict with user_seconds, system_seconds and peak_rss_bytes, if they are available.
+    :rtype: tuple
+    """
+    global logger
+
+    if get_os_name() == "windows":
+        return_code = process.wait()
+        return return_code, get_windows_process_usage(process)
+
+    try:
+        import resource
+    except ImportError:
+        return process.wait(), {}
+
+    # ru_maxrss is in bytes on macOS and kilobytes on Linux.
+    rss_scale = 1 if get_os_name() == "darwin" else 1024
+    if hasattr(os, "wait4") and hasattr(os, "waitstatus_to_exitcode"):
+        try:
+            (pid, status, rusage) = os.wait4(process.pid, 0)
+        except ChildProcessError:
+            # The process was already reaped.
+            return process.wait(), {}
+        # Popen didn't reap the process, so tell Popen the exit code.
+        process.returncode = os.waitstatus_to_exitcode(status)
+        return process.returncode, {
+            "user_seconds": rusage.ru_utime,
+            "system_seconds": rusage.ru_stime,
+            "peak_rss_bytes": rusage.ru_maxrss * rss_scale,
+        }
+
+    before = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return_code = process.wait()
+    after = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return return_code, {
+        "user_seconds": after.ru_utime - before.ru_utime,
+        "system_seconds": after.ru_stime - before.ru_stime,
+        # The peak of all children. This is the peak of the process unless an earlier child used more memory.
+        "peak_rss_bytes": after.ru_maxrss * rss_scale,
+    }
+
+
+def get_windows_process_usage(process: subprocess.Popen) -> dict:
+    """
+    get_windows_process_usage will return the CPU times and peak working set of the exited Windows process from
+    GetProcessTimes() and K32GetProcessMemoryInfo().
+    :param process: The exited process. The process handle is still open.
+    :type process: subprocess.Popen
+    :return: A dict with user_seconds, system_seconds and peak_rss_bytes, or an empty dict if they are not available.
+    :rtype: dict
+    """
+    global logger
+    try:
+        import ctypes
+        from ctypes import wintypes
+
+        class ProcessMemoryCounters(ctypes.Structure):
+            _fields_ = [
+                ("cb", wintypes.DWORD),
+                ("PageFaultCount", wintypes.DWORD),
+                ("PeakWorkingSetSize", ctypes.c_size_t),
+                ("WorkingSetSize", ctypes.c_size_t),
+                ("QuotaPeakPagedPoolUsage", ctypes.c_size_t),
+                ("QuotaPagedPoolUsage", ctypes.c_size_t),
+                ("QuotaPeakNonPagedPoolUsage", ctypes.c_size_t),
+                ("QuotaNonPagedPoolUsage", ctypes.c_size_t),
+                ("PagefileUsage", ctypes.c_size_t),
+                ("PeakPagefileUsage", ctypes.c_size_t),
+            ]
+
+        kernel32 = ctypes.windll.kernel32
+        handle = wintypes.HANDLE(int(process._handle))
+        (creation, exit_time, kernel, user) = (wintypes.FILETIME() for _ in range(4))
+        if not kernel32.GetProcessTimes(handle, ctypes.byref(creation), ctypes.byref(exit_time), ctypes.byref(kernel),
+                                        ctypes.byref(user)):
+            return {}
+        counters = ProcessMemoryCounters()
+        counters.cb = ctypes.sizeof(counters)
+        if not kernel32.K32GetProcessMemoryInfo(handle, ctypes.byref(counters), counters.cb):
+            counters.PeakWorkingSetSize = 0
+    except (ImportError, AttributeError, OSError) as err2:
+        logger.debug(f"Failed to get the resource usage of the process: {err2}")
+        return {}
+
+    # FILETIME is in 100 nanosecond intervals.
+    return {
+        "user_seconds": ((user.dwHighDateTime << 32) + user.dwLowDateTime) / 10000000,
+        "system_seconds": ((kernel.dwHighDateTime << 32) + kernel.dwLowDateTime) / 10000000,
+        "peak_rss_bytes": counters.PeakWorkingSetSize,
+    }
+
+
+def write_input(destination, data: bytes) -> None:
+    """
+    write_input will write data to the stdin of the child process and close it.
+    :param destination: Pipe to the child process.
+    :type destination: typing.BinaryIO
+    :param data: Data to write.
+    :type data: bytes
+    """
+    try:
+        with destination:
+            destination.write(data)
+    except BrokenPipeError:
+        # The child process exited without reading all of stdin.
+        pass
+
+
+def forward_output(source, destination, tail: collections.deque, first_output: list, byte_count: list) -> None:
+    """
+    forward_output will copy the child process output from source to destination line by line, keeping the last lines
+    in tail.
+    :param source: Pipe from the child process.
+    :type source: typing.BinaryIO
+    :param destination: Stream to forward the output to, i.e. sys.stdout or sys.stderr.
+    :type destination: typing.TextIO
+    :param tail: Bounded deque that holds the last lines of output.
+    :type tail: collections.deque
+    :param first_output: The time the first output was received is appended to this list.
+    :type first_output: list
+    :param byte_count: The number of bytes forwarded is added to the first item of this list.
+    :type byte_count: list
+    """
+    # Write the bytes unchanged if possible, so the encoding of the child process is preserved.
+    buffer = getattr(destination, "buffer", None)
+    with source:
+        for line in iter(lambda: source.readline(output_line_limit), b""):
+            if not first_output:
+                first_output.append(time.perf_counter())
+            byte_count[0] += len(line)
+            text = line.decode("utf-8", errors="replace")
+            if buffer is not None:
+                buffer.write(line)
+                buffer.flush()
+            else:
+                destination.write(text)
+                destination.flush()
+            tail.append(text)
 
 
 def is_installed(binary_name: str) -> bool:
     """
-    Check if the binary is installed in bin_dir.
+    Check if the binary is installed in bin_dir. The binary is bin_file, which includes the version if
+    WRAPPER_BINARY_VERSION is defined. Nothing is removed here. install_binary() removes a binary that is not
+    installed while it holds the install lock.
     :param binary_name: Filename to test if installed.
     :type binary_name: str
-    :return: True if the binary file exists (i.e. installed) in bin_dir; False otherwise
+    :return: True if the binary file exists (i.e. installed) in bin_dir and matches its manifest; False otherwise
     :rtype: bool
     """
     global logger, config
-    exe_ext = get_exe_ext()
-    file_path = os.path.join(config["bin_dir"], f"{binary_name}{exe_ext}")
+    file_path = config["bin_file"]
     if not os.path.isfile(file_path):
-        logger.info(f'{binary_name}{exe_ext} is not installed in {config["bin_dir"]}')
+        logger.info(f'{os.path.basename(file_path)} is not installed in {os.path.dirname(file_path)}')
         return False
 
-    # Zero byte files represent failed downloads. Delete the file and report not installed to download again.
-    if os.path.isfile(file_path) and os.path.getsize(file_path) == 0:
-        logger.info(f'Deleting zero byte file to force download: "{file_path}"')
-        os.remove(file_path)
+    # Zero byte files represent failed downloads.
+    if os.path.getsize(file_path) == 0:
+        logger.info(f'Binary "{file_path}" is a zero byte file')
+        return False
+
+    # Corrupt or truncated binaries are downloaded again.
+    if not verify_binary(file_path):
+        logger.warning(f'Binary "{file_path}" does not match its manifest')
+        return False
+
+    return True
+
+
+def remove_binary(file_path: str) -> None:
+    """
+    remove_binary will remove the binary and its manifest, so they are downloaded again. This is only called while
+    holding the install lock.
+    :param file_path: Full path to the binary.
+    :type file_path: str
+    """
+    global logger
+    for path in (file_path, get_manifest_file(file_path)):
+        if os.path.isfile(path):
+            logger.info(f'Deleting "{path}" to force download')
+            os.remove(path)
+
+
+def get_manifest_file(file_path: str) -> str:
+    """
+    get_manifest_file will return the manifest filename of the binary. The manifest is a JSON file next to the binary
+    with the size, modification time, inode and SHA-256 hash of the binary.
+    :param file_path: Full path to the binary.
+    :type file_path: str
+    :return: Full path to the manifest.
+    :rtype: str
+    """
+    return f"{file_path}.manifest.json"
+
+
+def get_stat_fingerprint(file_path: str) -> dict:
+    """
+    get_stat_fingerprint will return the size, modification time and inode of the file. If the fingerprint has not
+    changed, the file has not changed, and it does not need to be hashed again.
+    :param file_path: Full path to the file.
+    :type file_path: str
+    :return: The fingerprint of the file.
+    :rtype: dict
+    """
+    stat = os.stat(file_path)
+    return {
+        "size": stat.st_size,
+        "mtime_ns": stat.st_mtime_ns,
+        "inode": stat.st_ino,
+    }
+
+
+def hash_file(file_path: str) -> str:
+    """
+    hash_file will return the SHA-256 hash of the file.
+    :param file_path: Full path to the file.
+    :type file_path: str
+    :return: The hex digest of the file.
+    :rtype: str
+    """
+    global logger
+    start = time.perf_counter()
+    sha256 = hashlib.sha256()
+    with open(file_path, "rb") as file:
+        while True:
+            chunk = file.read(download_chunk_size)
+            if not chunk:
+                break
+            sha256.update(chunk)
+    logger.debug(f'Hashed "{file_path}" in {time.perf_counter() - start:.2f}s')
+    return sha256.hexdigest()
+
+
+def write_manifest(file_path: str, binary_file: str, sha256: str = None) -> None:
+    """
+    write_manifest will write the manifest of the file for the binary. The manifest is written to a unique temporary
+    file and renamed, so concurrent wrappers that rebuild the manifest don't overwrite each other's partial file. A
+    failure to write the manifest, i.e. a read-only bin_dir, is logged and ignored; the manifest is rebuilt later.
+    :param file_path: Full path to the file to fingerprint and hash. This is the binary or the download of the binary.
+    :type file_path: str
+    :param binary_file: Full path to the binary. The manifest is saved next to the binary.
+    :type binary_file: str
+    :param sha256: The SHA-256 hash of the file, if it's known. Default: the file is hashed
+    :type sha256: str
+    """
+    global logger
+    manifest = get_stat_fingerprint(file_path)
+    manifest["sha256"] = sha256 or hash_file(file_path)
+    manifest_file = get_manifest_file(binary_file)
+    part_file = None
+    try:
+        (fd, part_file) = tempfile.mkstemp(dir=os.path.dirname(manifest_file), suffix=".part")
+        with os.fdopen(fd, "w") as file:
+            json.dump(manifest, file)
+        os.replace(part_file, manifest_file)
+    except OSError as err2:
+        logger.warning(f'Failed to write manifest "{manifest_file}": {err2}')
+        if part_file is not None and os.path.isfile(part_file):
+            os.remove(part_file)
+
+
+def get_binary_hash(file_path: str) -> str:
+    """
+    get_binary_hash will return the SHA-256 hash of the binary from its manifest, hashing the binary only if the
+    manifest is missing or does not match the binary.
+    :param file_path: Full path to the binary.
+    :type file_path: str
+    :return: The hex digest of the binary.
+    :rtype: str
+    """
+    try:
+        with open(get_manifest_file(file_path), "r") as file:
+            manifest = json.load(file)
+        fingerprint = get_stat_fingerprint(file_path)
+        if all(manifest.get(key) == value for key, value in fingerprint.items()):
+            return manifest["sha256"]
+    except (OSError, ValueError, KeyError, TypeError, AttributeError):
+        pass
+    return hash_file(file_path)
+
+
+def verify_binary(file_path: str) -> bool:
+    """
+    verify_binary will check the binary against its manifest. If the size, modification time and inode match the
+    manifest, the binary is accepted without hashing it. Otherwise, the binary is hashed and compared to the hash in
+    the manifest, and the manifest is updated with the new fingerprint if the hash matches. A binary without a
+    manifest is not verified, since the manifest is only written after a complete download.
+    :param file_path: Full path to the binary.
+    :type file_path: str
+    :return: True if the binary matches the manifest; False if the binary is corrupt.
+    :rtype: bool
+    """
+    global logger
+
+    manifest_file = get_manifest_file(file_path)
+    try:
+        with open(manifest_file, "r") as file:
+            manifest = json.load(file)
+        sha256 = manifest["sha256"]
+    except (OSError, ValueError, KeyError, TypeError):
+        logger.info(f'Manifest for "{file_path}" is missing or unreadable. The binary is not verified.')
         return False
 
+    fingerprint = get_stat_fingerprint(file_path)
+    if all(manifest.get(key) == value for key, value in fingerprint.items()):
+        return True
+
+    # The file was touched, copied or modified. Only the hash can tell which.
+    logger.debug(f'Fingerprint of "{file_path}" changed. Verifying the hash.')
+    if fingerprint["size"] != manifest.get("size"):
+        return False
+    actual = hash_file(file_path)
+    if actual != sha256:
+        logger.warning(f'Hash of "{file_path}" is "{actual}", expected "{sha256}"')
+        return False
+    # Don't record the fingerprint of a binary that was replaced while it was hashed.
+    if get_stat_fingerprint(file_path) == fingerprint:
+        write_manifest(file_path, file_path, actual)
     return True
 
 
@@ -319,6 +3083,23 @@ def get_os_name() -> str:
     return platform.system().lower()
 
 
+def get_peak_rss() -> int:
+    """
+    get_peak_rss will return the peak resident set size (RSS) of this process.
+    :return: Peak RSS in bytes, or 0 if it's not available (i.e. Windows).
+    :rtype: int
+    """
+    try:
+        import resource
+    except ImportError:
+        return 0
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and kilobytes on Linux.
+    if get_os_name() == "darwin":
+        return peak_rss
+    return peak_rss * 1024
+
+
 def set_bin_dir() -> None:
     """
     set_bin_dir will set the bin directory (BIN_DIR). The env variable WRAPPER_BIN_DIR will be used if defined.
@@ -349,7 +3130,12 @@ def set_bin_file() -> None:
     """
     global config
     exe_ext = get_exe_ext()
-    config["bin_file"] = os.path.join(config["bin_dir"], f'{config["wrapper"]["WRAPPER_BINARY"]}{exe_ext}')
+    binary_name = config["wrapper"]["WRAPPER_BINARY"]
+    version = get_binary_version()
+    if version is None:
+        config["bin_file"] = os.path.join(config["bin_dir"], f"{binary_name}{exe_ext}")
+    else:
+        config["bin_file"] = os.path.join(get_versions_dir(binary_name), version, f"{binary_name}{exe_ext}")
     logger.debug(f'bin_file: "{config["bin_file"]}"')
 
 
@@ -377,13 +3163,7 @@ def set_tmp_file(cleanup: bool = True):
     :type cleanup: bool
     """
     global logger, config
-    suffix = ""
-    if config["wrapper"]["WRAPPER_BINARY"] == "rustpython":
-        suffix = ".py"
-    elif config["wrapper"]["WRAPPER_BINARY"] == "deno":
-        suffix = ".ts"
-    elif config["wrapper"]["WRAPPER_BINARY"] == "nushell":
-        suffix = ".nu"
+    suffix = get_script_ext()
 
     if config["tmp_file"] is None or config["tmp_file"] == "":
         # tmp_file has not been assigned yet.
@@ -397,6 +3177,34 @@ def set_tmp_file(cleanup: bool = True):
             (_, config["tmp_file"]) = tempfile.mkstemp(suffix=suffix)
 
 
+def set_cache_dir() -> None:
+    """
+    set_cache_dir will set the cache directory used to store downloaded scripts. The cache directory is in bin_dir.
+    """
+    global config
+    config["cache_dir"] = os.path.join(config["bin_dir"], "cache")
+    if not os.path.isdir(config["cache_dir"]):
+        os.makedirs(config["cache_dir"])
+
+
+def get_script_ext() -> str:
+    """
+    get_script_ext will return the script extension for the binary.
+    :return: The script extension is returned.
+    :rtype: str
+    """
+    global config
+    script_ext = ""
+    script_ext_map = {
+        "rustpython": ".py",
+        "deno": ".ts",
+        "nushell": ".nu",
+    }
+    if config["wrapper"]["WRAPPER_BINARY"] in script_ext_map:
+        script_ext = script_ext_map[config["wrapper"]["WRAPPER_BINARY"]]
+    return script_ext
+
+
 def get_logger() -> logging.Logger:
     """
     get_logger will return a logger to the global logging instance.
@@ -468,6 +3276,69 @@ def get_download_url(binary_name: str) -> str:
         raise ValueError(f'Unsupported OS "{os_name}" or architecture "{arch_name}"')
 
 
+def get_download_urls(binary_name: str) -> list:
+    """
+    get_download_urls will return the URLs of the binary on the mirrors in WRAPPER_MIRRORS, followed by the public URL
+    from get_download_url(). Mirrors that are directories are converted to file:// URLs. If WRAPPER_BINARY_VERSION is
+    defined, the URLs are for the version.
+    :param binary_name: Name of the binary.
+    :type binary_name: str
+    :return: List of URLs in priority order. The public URL is last.
+    :rtype: list
+    """
+    global config
+    public_url = get_download_url(binary_name)
+    if public_url is None:
+        return []
+    (base_url, file_name) = public_url.rsplit("/", 1)
+    if get_binary_version() is not None:
+        # Versioned binaries are in a directory named after the version.
+        file_name = f"{get_binary_version()}/{file_name}"
+        public_url = f"{base_url}/{file_name}"
+
+    urls = []
+    for mirror in get_config_option("wrapper", "WRAPPER_MIRRORS", "").split(","):
+        mirror = mirror.strip()
+        if mirror == "":
+            continue
+        if "://" not in mirror:
+            import pathlib
+            mirror = pathlib.Path(os.path.abspath(mirror)).as_uri()
+        urls.append(f'{mirror.rstrip("/")}/{file_name}')
+    urls.append(public_url)
+    return urls
+
+
+def get_config_option(section: str, key: str, default):
+    """
+    get_config_option will return the value of the key in the config section, converted to the type of the default.
+    :param section: Config section, "wrapper" or "exec".
+    :type section: str
+    :param key: Variable name.
+    :type key: str
+    :param default: Value returned if the variable is not defined. The type of the default determines the return type.
+    :type default: any
+    :return: The value of the variable.
+    :rtype: any
+    """
+    global logger, config
+    if key not in config[section] or config[section][key] == "":
+        return default
+
+    value = config[section][key]
+    try:
+        if isinstance(default, bool):
+            return str(value).lower() in ("1", "true", "yes", "on")
+        if isinstance(default, int):
+            return int(value)
+        if isinstance(default, float):
+            return float(value)
+    except ValueError:
+        logger.warning(f'Invalid value "{value}" for {key}. Using the default "{default}"')
+        return default
+    return value
+
+
 def get_config() -> None:
     """
     get_config will process 4 different types of keys. The keys are in the global namespace or environment
@@ -518,6 +3389,7 @@ def main():
     """
     global logger, config
 
+    phase_start = time.perf_counter()
     # Get the configuration from the environment and global variables.
     get_config()
 
@@ -525,27 +3397,33 @@ def main():
         logger.error("WRAPPER_BINARY variable is not defined")
         raise ValueError("WRAPPER_BINARY variable is not defined")
 
-    set_tmp_file(False)
     set_bin_dir()
-    logger.debug(f'tmp_file: {config["tmp_file"]}')
     logger.debug(f'bin_dir: {config["bin_dir"]}')
 
     if not os.path.isdir(config["bin_dir"]):
         # Create bin_dir and all parent directories
         os.makedirs(config["bin_dir"])
 
+    set_cache_dir()
+    logger.debug(f'cache_dir: {config["cache_dir"]}')
+
     set_bin_file()
     logger.debug(f'bin_file: {config["bin_file"]}')
 
-    try:
-        # Download the binary
-        if not is_installed(config["wrapper"]["WRAPPER_BINARY"]):
-            download_binary(config["wrapper"]["WRAPPER_BINARY"])
-    except:
-        logger.error(f'Failed to download the binary "{config["wrapper"]["WRAPPER_BINARY"]}"')
-        raise ValueError(f'Failed to download the binary "{config["wrapper"]["WRAPPER_BINARY"]}"')
-
-    if config["wrapper"]["WRAPPER_BINARY"] == "deno" and "WRAPPER_DOWNLOAD_URL" not in config["wrapper"]:
+    if config["wrapper"]["WRAPPER_BINARY"] == "deno":
+        set_deno_dir()
+    record_phase("config", phase_start)
+    phase_start = time.perf_counter()
+
+    batch_urls = get_batch_urls()
+    if batch_urls:
+        results = run_batch(batch_urls)
+        record_phase("batch", phase_start)
+        failed = [result["url"] for result in results if result["return_code"] != 0]
+        if failed:
+            logger.error(f"{len(failed)} of {len(results)} batch scripts failed: {failed}")
+            raise ValueError(f"{len(failed)} of {len(results)} batch scripts failed")
+    elif config["wrapper"]["WRAPPER_BINARY"] == "deno" and "WRAPPER_DOWNLOAD_URL" not in config["wrapper"]:
         # Run Deno with a remote URL.
         if (
             "WRAPPER_REMOTE_REPO" not in config["wrapper"]
@@ -563,8 +3441,14 @@ def main():
         remote_version = config["wrapper"]["WRAPPER_REMOTE_VERSION"]
         remote_script = config["wrapper"]["WRAPPER_REMOTE_SCRIPT"]
         script_download_url = f'{remote_url}/{remote_version}/{remote_script}'
+
+        # Deno downloads the script itself.
+        download_all(config["wrapper"]["WRAPPER_BINARY"], None)
+        record_phase("download", phase_start)
+        phase_start = time.perf_counter()
         try:
             exec_script(script_download_url)
+            record_phase("exec", phase_start)
         except:
             logger.error(
                 f'Failed to run the script "{script_download_url}" with the binary "{config["bin_file"]}"'
@@ -572,35 +3456,71 @@ def main():
             raise ValueError(
                 f'Failed to run the script "{script_download_url}" with the binary "{config["bin_file"]}"'
             )
+        finally:
+            label_resource_usage(script_download_url)
     else:
         script_download_url = None
-        if "WRAPPER_DOWNLOAD_URL" in os.environ:
-            script_download_url = os.getenv("WRAPPER_DOWNLOAD_URL")
+        if "WRAPPER_DOWNLOAD_URL" in config["wrapper"]:
+            script_download_url = config["wrapper"]["WRAPPER_DOWNLOAD_URL"]
+        elif (
+            "WRAPPER_REMOTE_REPO" in config["wrapper"]
+            and "WRAPPER_REMOTE_VERSION" in config["wrapper"]
+            and "WRAPPER_REMOTE_SCRIPT" in config["wrapper"]
+        ):
+            # Compose the URL from the remote variables. This allows the script to be cached by version.
+            remote_url = config["wrapper"]["WRAPPER_REMOTE_REPO"]
+            remote_version = config["wrapper"]["WRAPPER_REMOTE_VERSION"]
+            remote_script = config["wrapper"]["WRAPPER_REMOTE_SCRIPT"]
+            script_download_url = f'{remote_url}/{remote_version}/{remote_script}'
         else:
             logger.error("WRAPPER_DOWNLOAD_URL variable is not defined")
             raise ValueError("WRAPPER_DOWNLOAD_URL variable is not defined")
 
-        script = None
-        try:
-            # Download the script
-            script = download_script(script_download_url)
-        except:
-            logger.error(
-                f'Failed to download the script from URL "{script_download_url}"'
-            )
-            raise ValueError(
-                f'Failed to download the script from URL "{script_download_url}"'
-            )
+        in_process = (
+            config["wrapper"]["WRAPPER_BINARY"] == "rustpython"
+            and get_config_option("wrapper", "WRAPPER_IN_PROCESS", False)
+        )
+        in_memory = not in_process and get_config_option("wrapper", "WRAPPER_IN_MEMORY", False)
+        if in_memory and get_in_memory_method() is None:
+            logger.info(f'Cannot pass the script to "{config["wrapper"]["WRAPPER_BINARY"]}" in memory. Using a file.')
+            in_memory = False
+
+        if in_memory:
+            # The script is held in memory and never written to disk.
+            script = "<memory>"
+            script_content = download_all(config["wrapper"]["WRAPPER_BINARY"], script_download_url,
+                                          download_script_content)
+        elif in_process:
+            # The script is run by this interpreter. The binary is not needed.
+            try:
+                script = get_script_downloader()(script_download_url)
+            except:
+                logger.error(f'Failed to download the script from URL "{script_download_url}"')
+                raise ValueError(f'Failed to download the script from URL "{script_download_url}"')
+        else:
+            # Download the binary and the script
+            script = download_all(config["wrapper"]["WRAPPER_BINARY"], script_download_url)
+
+        record_phase("download", phase_start)
+        phase_start = time.perf_counter()
 
         try:
-            exec_script(config["tmp_file"])
+            if in_memory:
+                exec_script_in_memory(script_content)
+            elif in_process:
+                exec_script_in_process(script)
+            else:
+                exec_script(script)
+            record_phase("exec", phase_start)
         except:
             logger.error(
-                f'Failed to run the script "{config["tmp_file"]}" with the binary "{config["bin_file"]}"'
+                f'Failed to run the script "{script}" with the binary "{config["bin_file"]}"'
             )
             raise ValueError(
-                f'Failed to run the script "{config["tmp_file"]}" with the binary "{config["bin_file"]}"'
+                f'Failed to run the script "{script}" with the binary "{config["bin_file"]}"'
             )
+        finally:
+            label_resource_usage(script_download_url)
 
     # Move out of the temporary directory, so we don't prevent it from being deleted.
     os.chdir(config["bin_dir"])
@@ -619,5 +3539,8 @@ if __name__ == "__main__":
         logging.error(f"Failed to finish successfully")
         logging.error(f"Received error: {err}")
         exit(1)
+    finally:
+        report_phases()
+        report_resource_usage()
 
     exit(0)
@@ -8,7 +8,7 @@ all-task-runner will run tasks from a repo using 'task'. The tasks are downloade
 Python, which is automatically deleted afterward. Binaries are downloaded into RUNNER_BIN_DIR. If 'task' does not
 exist, it will be downloaded into RUNNER_BIN_DIR and the task 'init:all` will be run to download other necessary
 binaries. Any temporary files, such as configuration files, are stored in the temporary directory, to be cleaned up
-when the task is done.
+when the task is done. 'task', the library and your taskfiles are downloaded at the same time.
 
 Uninstallation is done by removing the binaries downloaded to RUNNER_BIN_DIR. all-task-runner does not keep track of
 these binaries.
@@ -39,6 +39,22 @@ Environmental variables
   Default:
     Windows: 'C:\\ProgramData\\task-runner\\bin'
     *nix: '/opt/task-runner/bin'
+- RUNNER_CACHE_DIR is the directory to cache the GitHub release metadata.
+  Default:
+    Windows: 'C:\\ProgramData\\task-runner\\cache'
+    *nix: '/opt/task-runner/cache'
+- RUNNER_RELEASE_TTL is the number of seconds the cached GitHub release metadata is used without asking GitHub. After
+  the TTL, the release is revalidated with the ETag. A "304 Not Modified" does not count against GitHub's rate limit.
+  The cached release is used if GitHub can't be reached or the rate limit is exceeded.
+  Default: 3600
+- RUNNER_EXTRACT_WORKERS is the number of threads to extract ZIP archives. zlib releases the GIL, so members are
+  decompressed in parallel. Set to 1 to extract on a single thread.
+  Default: the number of CPUs, up to 8
+
+Releases of type 'repo' are extracted once per tag into RUNNER_CACHE_DIR/repos and used from there until a new tag is
+released. A release is only cached after the whole archive was downloaded and verified. Each run copies the cached
+release into its temporary directory and runs the tasks there, so the cache is not changed by the tasks. The previous
+tag is kept for runs that are still using it; older tags are removed.
 """
 import dataclasses
 import json
@@ -50,6 +66,7 @@ import requests
 import shutil
 import subprocess
 import tempfile
+import time
 
 """
 logger is the global logging instance set by get_logger().
@@ -67,6 +84,17 @@ bin_dir is the directory that holds the binaries.
 """
 bin_dir: str | None = None
 
+"""
+cache_dir is the directory that holds the cached GitHub release metadata and the extracted releases.
+"""
+cache_dir: str | None = None
+
+"""
+release_marker is the file written into an extracted release after the archive was verified. A cached release without
+it is downloaded again.
+"""
+release_marker = '.runner-release.json'
+
 
 @dataclasses.dataclass
 class GitHubRepo:
@@ -143,8 +171,7 @@ class GitHubRepo:
             logger.debug(f'GitHubRepo: Downloading JSON from URL "{self.name}" for "{self.name}"')
             # Get the release JSON from GitHub's API
             self.get_api_url()
-            response = requests.get(self.api_url, stream=True)
-            self.latest_json = json.loads(response.content)
+            self.latest_json = self.get_cached_json()
             if self.latest_json == '':
                 logger.error(f'GitHubRepo: Failed to download JSON from GitHub API for repo "{self.name}"')
                 logger.error(self.latest_json)
@@ -158,6 +185,103 @@ class GitHubRepo:
             logger.error(f'Failed to get the latest JSON from GitHub')
             raise
 
+    def get_cached_json(self) -> any:
+        """
+        get_cached_json will return the latest release JSON from the release cache in cache_dir. The cached release is
+        used without a request for RUNNER_RELEASE_TTL seconds. After that, the release is revalidated with the ETag; a
+        "304 Not Modified" does not count against GitHub's rate limit. If GitHub can't be reached or the rate limit is
+        exceeded, the cached release is used regardless of its age.
+        :return: JSON object
+        :rtype: any
+        """
+        global logger
+        cache = self.read_cache()
+        ttl = get_env_int('RUNNER_RELEASE_TTL', 3600)
+        if cache and time.time() - cache['fetched_at'] < ttl:
+            logger.debug(f'GitHubRepo: Using the cached release for "{self.name}"')
+            return cache['json']
+
+        headers = {'Accept': 'application/vnd.github+json'}
+        if cache and cache.get('etag'):
+            headers['If-None-Match'] = cache['etag']
+        try:
+            response = requests.get(self.api_url, headers=headers, timeout=30)
+        except requests.RequestException as err:
+            if cache:
+                logger.warning(f'GitHubRepo: Failed to connect to GitHub: {err}')
+                logger.warning(f'GitHubRepo: Using the cached release for "{self.name}"')
+                return cache['json']
+            raise
+
+        if response.status_code == 304 and cache:
+            logger.debug(f'GitHubRepo: The release for "{self.name}" has not changed')
+            cache['fetched_at'] = time.time()
+            self.write_cache(cache)
+            return cache['json']
+        if response.status_code in (403, 429) and cache:
+            # GitHub returns 403 or 429 when the rate limit is exceeded.
+            logger.warning(f'GitHubRepo: GitHub returned status code {response.status_code}. Rate limit remaining: '
+                           f'{response.headers.get("X-RateLimit-Remaining")}')
+            logger.warning(f'GitHubRepo: Using the cached release for "{self.name}"')
+            return cache['json']
+        response.raise_for_status()
+
+        latest_json = json.loads(response.content)
+        self.write_cache({
+            'etag': response.headers.get('ETag'),
+            'fetched_at': time.time(),
+            'json': latest_json,
+        })
+        return latest_json
+
+    def get_cache_file(self) -> str:
+        """
+        get_cache_file will return the release cache file for the repo.
+        :return: Full path to the cache file.
+        :rtype: str
+        """
+        global cache_dir
+        return os.path.join(cache_dir, 'releases', f'{self.name.replace("/", "__")}.json')
+
+    def read_cache(self) -> dict:
+        """
+        read_cache will read the cached release for the repo.
+        :return: The cache with the keys etag, fetched_at and json, or an empty dict if the release is not cached.
+        :rtype: dict
+        """
+        global logger
+        cache_file = self.get_cache_file()
+        if not os.path.isfile(cache_file):
+            return {}
+        try:
+            with open(cache_file, 'r') as file:
+                cache = json.load(file)
+            cache['fetched_at'] = float(cache['fetched_at'])
+            if not cache['json']:
+                return {}
+            return cache
+        except (OSError, ValueError, KeyError, TypeError):
+            logger.warning(f'GitHubRepo: Ignoring the unreadable release cache "{cache_file}"')
+            return {}
+
+    def write_cache(self, cache: dict) -> None:
+        """
+        write_cache will save the release for the repo in the cache. The file is replaced atomically so other runs
+        never read a partial file.
+        :param cache: The cache with the keys etag, fetched_at and json.
+        :type cache: dict
+        """
+        global logger
+        cache_file = self.get_cache_file()
+        try:
+            os.makedirs(os.path.dirname(cache_file), exist_ok=True)
+            (fd, part_file) = tempfile.mkstemp(dir=os.path.dirname(cache_file), suffix='.part')
+            with os.fdopen(fd, 'w') as file:
+                json.dump(cache, file)
+            os.replace(part_file, cache_file)
+        except OSError as err:
+            logger.warning(f'GitHubRepo: Failed to save the release cache "{cache_file}": {err}')
+
     def get_json_value(self, key: str) -> str:
         """
         Get the value in the latest JSON for the given key.
@@ -248,15 +372,59 @@ class GitHubRepo:
 
         try:
             logger.debug(f'GitHubRepo: Downloading JSON from URL "{self.json_download_url}" to file "{filename}"')
-            response = requests.get(self.json_download_url, stream=True)
-            file = open(filename, 'wb')
-            file.write(response.content)
-            file.close()
-            response.close()
+            with requests.get(self.json_download_url, stream=True) as response:
+                response.raise_for_status()
+                with open(filename, 'wb') as file:
+                    for chunk in response.iter_content(chunk_size=1024 * 1024):
+                        file.write(chunk)
         except:
             logger.error(f'GitHubRepo: Failed to download JSON from URL "{self.json_download_url}"')
             raise
 
+    def extract_latest(self, dest_dir: str, members: list[str] | None = None) -> str:
+        """
+        extract_latest will download the latest release that matches the search_regexp and extract it into dest_dir.
+        tar.gz archives are extracted while they are downloaded without saving the archive. ZIP archives need random
+        access and are saved in dest_dir before they are extracted.
+        :param dest_dir: Full path to the directory to extract the asset
+        :type dest_dir: str
+        :param members: Names of the archive members to extract. All members are extracted if not specified.
+        :type members: list[str] | None
+        :return: The asset name of the archive
+        :rtype: str
+        """
+        global logger
+        try:
+            # Find the asset to download
+            if not self.latest_json:
+                logger.debug(f'GitHubRepo: Calling get_latest_json for "{self.name}" to extract into "{dest_dir}"')
+                self.get_latest_json()
+            self.get_download_url()
+            logger.debug(f'GitHubRepo: asset_url: {self.json_download_url}')
+            logger.debug(f'GitHubRepo: asset_name: {self.json_asset_name}')
+
+            decompress = Decompress(self.json_asset_name)
+            if decompress.is_streamable():
+                logger.debug(f'GitHubRepo: Extracting URL "{self.json_download_url}" into dir "{dest_dir}"')
+                with requests.get(self.json_download_url, stream=True) as response:
+                    response.raise_for_status()
+                    # Undo any Content-Encoding like response.content does.
+                    response.raw.decode_content = True
+                    decompress.extract_stream(response.raw, dest_dir, members)
+                    expected = response.headers.get('Content-Length')
+                    if expected is not None and response.raw.tell() != int(expected):
+                        logger.error(f'GitHubRepo: Received {response.raw.tell()} of {expected} bytes from URL '
+                                     f'"{self.json_download_url}"')
+                        raise ValueError(f'Received {response.raw.tell()} of {expected} bytes from URL '
+                                         f'"{self.json_download_url}"')
+            else:
+                archive_file = self.download_latest(dest_dir)
+                Decompress(archive_file).extract_to(dest_dir, members)
+            return self.json_asset_name
+        except:
+            logger.error(f'Failed to extract latest from URL "{self.json_download_url}" into dest_dir "{dest_dir}"')
+            raise
+
 
 @dataclasses.dataclass
 class Decompress:
@@ -267,11 +435,149 @@ class Decompress:
     """
     archive: str
 
-    def extract_to(self, dest_dir: str):
+    def is_streamable(self) -> bool:
+        """
+        is_streamable will return True if the archive can be extracted from a stream (tar.gz).
+        :return: True if the archive can be extracted with extract_stream().
+        :rtype: bool
+        """
+        return self.archive.endswith('.tar.gz') or self.archive.endswith('.tgz')
+
+    def extract_stream(self, fileobj, dest_dir: str, members: list[str] | None = None):
+        """
+        extract_stream will extract the tar.gz archive from the file object in a single pass, without seeking. This
+        allows extracting the archive directly from the HTTP response. If members is given, only those members are
+        extracted and the rest of the archive is skipped once they are found. The stream is always read to the end, so
+        the CRC and size in the gzip trailer are checked and a truncated archive raises a ValueError.
+        :param fileobj: File object to read the archive from.
+        :type fileobj: io.RawIOBase
+        :param dest_dir: Destination directory to extract the archive.
+        :type dest_dir: str
+        :param members: Names of the archive members to extract. All members are extracted if not specified.
+        :type members: list[str] | None
+        """
+        global logger
+        if not self.is_streamable():
+            logger.error(f'Decompress: Archive file "{self.archive}" does not end with ".tar.gz"')
+            raise ValueError(f'Archive file "{self.archive}" does not end with ".tar.gz"',
+                             'self.archive')
+
+        logger.debug(f'Decompress: Importing tarfile module')
+        import gzip
+        import tarfile
+        extract_args = {}
+        if hasattr(tarfile, 'data_filter'):
+            # The 'data' filter refuses absolute paths, links outside dest_dir and device files.
+            extract_args['filter'] = 'data'
+        wanted = set(members) if members else None
+
+        logger.debug(f'Decompress: Extracting files from "{self.archive}" stream into dir "{dest_dir}"')
+        # tarfile does not check the gzip trailer. GzipFile checks it at the end of the stream.
+        gzip_file = gzip.GzipFile(fileobj=fileobj, mode='rb')
+        try:
+            with tarfile.open(fileobj=gzip_file, mode='r|') as tar:
+                self.extract_members(tar, dest_dir, wanted, extract_args)
+            # Read the rest of the archive to get to the gzip trailer.
+            while gzip_file.read(1024 * 1024):
+                pass
+        except (EOFError, OSError, tarfile.ReadError) as err2:
+            logger.error(f'Decompress: Archive "{self.archive}" is truncated or corrupt: {err2}')
+            raise ValueError(f'Archive "{self.archive}" is truncated or corrupt: {err2}')
+        if wanted:
+            logger.warning(f'Decompress: Members not found in "{self.archive}": {", ".join(sorted(wanted))}')
+
+    def extract_members(self, tar, dest_dir: str, wanted: set[str] | None, extract_args: dict):
+        """
+        extract_members will extract the members of the tar stream into dest_dir. The names in wanted are removed as
+        they are extracted, and the loop stops once all of them are extracted.
+        :param tar: Tar stream opened with tarfile.open().
+        :type tar: tarfile.TarFile
+        :param dest_dir: Destination directory to extract the archive.
+        :type dest_dir: str
+        :param wanted: Names of the archive members to extract. All members are extracted if None.
+        :type wanted: set[str] | None
+        :param extract_args: Keyword arguments for TarFile.extract().
+        :type extract_args: dict
+        """
+        global logger
+        for member in tar:
+            name = member.name.removeprefix('./')
+            if wanted is not None and name not in wanted:
+                continue
+            if os.path.isabs(name) or '..' in name.split('/'):
+                logger.warning(f'Decompress: Skipping member "{member.name}" outside of dir "{dest_dir}"')
+                continue
+            tar.extract(member, dest_dir, **extract_args)
+            if wanted is not None:
+                wanted.discard(name)
+                if not wanted:
+                    # All requested members are extracted. Skip the rest of the archive.
+                    break
+
+    def extract_zip(self, dest_dir: str, members: list[str] | None = None):
+        """
+        extract_zip will extract the ZIP archive on a pool of RUNNER_EXTRACT_WORKERS threads. zlib releases the GIL
+        while decompressing, so the members are extracted in parallel. Every thread opens its own ZipFile because a
+        ZipFile shares one file position between its members. The directory tree is created before the files are
+        extracted. Members outside dest_dir (zip-slip) raise a ValueError before anything is extracted.
+        :param dest_dir: Destination directory to extract the archive.
+        :type dest_dir: str
+        :param members: Names of the archive members to extract. All members are extracted if not specified.
+        :type members: list[str] | None
+        """
+        global logger
+        logger.debug(f'Decompress: Importing zipfile module')
+        import zipfile
+        import concurrent.futures
+
+        dest_dir = os.path.realpath(dest_dir)
+        dirs = {dest_dir}
+        files = []
+        with zipfile.ZipFile(self.archive, 'r') as zip_file:
+            for info in zip_file.infolist():
+                if members and info.filename not in members:
+                    continue
+                # zipfile does not create symlinks, so normpath() is enough to resolve the member path.
+                target = os.path.normpath(os.path.join(dest_dir, info.filename))
+                if os.path.commonpath([dest_dir, target]) != dest_dir:
+                    logger.error(f'Decompress: Member "{info.filename}" is outside of dir "{dest_dir}"')
+                    raise ValueError(f'Member "{info.filename}" is outside of dir "{dest_dir}"',
+                                     'self.archive')
+                if info.is_dir():
+                    dirs.add(target)
+                else:
+                    dirs.add(os.path.dirname(target))
+                    files.append((info, target))
+
+        for directory in sorted(dirs):
+            os.makedirs(directory, exist_ok=True)
+
+        def extract_files(batch: list):
+            with zipfile.ZipFile(self.archive, 'r') as batch_zip:
+                for (batch_info, batch_target) in batch:
+                    with batch_zip.open(batch_info) as src, open(batch_target, 'wb') as dst:
+                        shutil.copyfileobj(src, dst, 1024 * 1024)
+
+        workers = get_env_int('RUNNER_EXTRACT_WORKERS', min(8, os.cpu_count() or 1))
+        workers = max(1, min(workers, len(files)))
+        # Deal the largest members out first so the batches are about the same size.
+        files.sort(key=lambda file: file[0].file_size, reverse=True)
+        batches = [files[index::workers] for index in range(workers)]
+        logger.debug(f'Decompress: Extracting {len(files)} files with {workers} threads')
+        if workers == 1:
+            extract_files(files)
+            return
+        with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+            for future in [executor.submit(extract_files, batch) for batch in batches]:
+                future.result()
+
+    def extract_to(self, dest_dir: str, members: list[str] | None = None):
         """
         extract_to will extract the archive in the given dest_dir.
         :param dest_dir: Destination directory to extract the archive.
         :type dest_dir: str
+        :param members: Names of the archive members to extract. All members are extracted if not specified.
+        :type members: list[str] | None
         """
         global logger
         if self.archive == '':
@@ -284,19 +590,12 @@ class Decompress:
                              'dest_dir')
 
         if self.archive.endswith('.zip'):
-            logger.debug(f'Decompress: Importing zipfile module')
-            import zipfile
             logger.debug(f'Decompress: Extracting files from "{self.archive}" into dir "{dest_dir}"')
-            with zipfile.ZipFile(self.archive, 'r') as zip_file:
-                zip_file.extractall(dest_dir)
+            self.extract_zip(dest_dir, members)
 
-        elif self.archive.endswith('.tar.gz') or self.archive.endswith('.tgz'):
-            logger.debug(f'Decompress: Importing tarfile module')
-            import tarfile
-            logger.debug(f'Decompress: Extracting files from "{self.archive}" into dir "{dest_dir}"')
-            tar = tarfile.open(self.archive, "r:gz")
-            tar.extractall(dest_dir)
-            tar.close()
+        elif self.is_streamable():
+            with open(self.archive, 'rb') as file:
+                self.extract_stream(file, dest_dir, members)
 
         else:
             logger.info(f'Decompress: Archive file "{self.archive}" does not end with ".zip" or ".tar.gz"')
@@ -356,6 +655,7 @@ class TaskRunner:
 
         asset_dir = ''
         asset_name = ''
+        stage_dir = ''
         try:
             (_, asset_name) = self.location.split('/')
             logger.debug(f'TaskRunner: Creating new GitHubRepo: name: "{self.location}"; asset_name: {asset_name}')
@@ -377,46 +677,132 @@ class TaskRunner:
         try:
             asset_basename = github_repo.get_asset_basename()
             logger.debug(f'TaskRunner: download_latest(): asset_basename: "{asset_basename}')
-            archive_file = github_repo.download_latest(self.tmp_dir)
-            logger.debug(f'TaskRunner: download_latest(): archive_file: "{archive_file}')
+            tag_dir = self.get_cached_repo_dir(github_repo.json_tag_name)
+            if self.is_cached_release(tag_dir):
+                logger.debug(f'TaskRunner: Using the cached release "{github_repo.json_tag_name}" in "{tag_dir}"')
+                # The modification time marks the tag as recently used.
+                os.utime(tag_dir)
+                self.set_taskfile_dir(tag_dir)
+                return os.path.basename(tag_dir)
+            if os.path.isdir(tag_dir):
+                # Left by a run that did not finish the extract. Move it out of the way before removing it, since other
+                # runs may be looking at it.
+                logger.info(f'TaskRunner: Cached release in "{tag_dir}" is not complete. Downloading it again.')
+                broken_dir = tempfile.mkdtemp(dir=os.path.dirname(tag_dir), prefix='.stage-')
+                os.rename(tag_dir, os.path.join(broken_dir, 'broken'))
+                shutil.rmtree(broken_dir, ignore_errors=True)
+            # Download and extract in a staging directory next to the cache so the tree can be renamed into place.
+            os.makedirs(os.path.dirname(tag_dir), exist_ok=True)
+            stage_dir = tempfile.mkdtemp(dir=os.path.dirname(tag_dir), prefix='.stage-')
+            archive_name = github_repo.extract_latest(stage_dir)
+            logger.debug(f'TaskRunner: extract_latest(): archive_name: "{archive_name}')
         except:
-            logger.error(f'TaskRunner: Failed to download the latest release')
+            logger.error(f'TaskRunner: Failed to download and extract the latest release')
+            if stage_dir:
+                shutil.rmtree(stage_dir, ignore_errors=True)
             raise
 
-        try:
-            # Extract the latest release for taskfiles
-            os_name = get_os_name()
-            (asset_dir, _) = os.path.splitext(archive_file)
-            if os_name == 'linux' or os_name == 'darwin':
-                decompress = Decompress(archive_file)
-                decompress.extract_to(self.tmp_dir)
-                # Need to remove one more extension for the '.tar' in .tar.gz
-                (asset_dir, _) = os.path.splitext(asset_dir)
-            elif os_name == 'windows':
-                decompress = Decompress(archive_file)
-                decompress.extract_to(self.tmp_dir)
-            else:
-                logger.error(f'TaskRunner: Unsupported OS: "{os_name}"')
-                raise ValueError(f'Unsupported OS: "{os_name}"', 'os_name')
-        except:
-            logger.error(f'TaskRunner: Failed to extract the archive')
-            raise
+        # The archive contains a directory named after the archive.
+        (asset_dir, _) = os.path.splitext(archive_name)
+        if archive_name.endswith('.tar.gz'):
+            # Need to remove one more extension for the '.tar' in .tar.gz
+            (asset_dir, _) = os.path.splitext(asset_dir)
 
         try:
-            self.taskfile_dir = os.path.join(self.tmp_dir, asset_dir)
-            if not os.path.isdir(self.taskfile_dir):
+            extract_dir = os.path.join(stage_dir, asset_dir)
+            if not os.path.isdir(extract_dir):
                 logger.error(f'TaskRunner: Failed to extract files from latest release download')
-                logger.error(f'TaskRunner: tmp_dir: "{self.tmp_dir}"')
+                logger.error(f'TaskRunner: stage_dir: "{stage_dir}"')
                 logger.error(f'TaskRunner: asset_dir: "{asset_dir}"')
                 logger.error(f'TaskRunner: asset_dir: "{asset_name}"')
                 raise ValueError(f'Failed to extract files from latest_json download',
-                                 f'tmp_dir: {self.tmp_dir}',
+                                 f'stage_dir: {stage_dir}',
                                  f'asset_dir: {asset_dir}',
                                  f'asset_name: {asset_name}')
+            # The extract is complete and verified. The marker is renamed into place with the tree.
+            with open(os.path.join(extract_dir, release_marker), 'w') as file:
+                json.dump({'tag_name': github_repo.json_tag_name, 'asset_name': archive_name}, file)
+            try:
+                os.rename(extract_dir, tag_dir)
+            except OSError:
+                # Another run renamed the same tag into place first. Use that tree.
+                if not os.path.isdir(tag_dir):
+                    raise
+                logger.debug(f'TaskRunner: Release "{github_repo.json_tag_name}" was cached by another run')
+            self.set_taskfile_dir(tag_dir)
+            self.remove_old_releases(tag_dir)
             return asset_dir
         except:
             logger.error(f'TaskRunner: Failed to download repository of type "{self.type}" from "{self.location}"')
             raise
+        finally:
+            shutil.rmtree(stage_dir, ignore_errors=True)
+
+    def is_cached_release(self, tag_dir: str) -> bool:
+        """
+        is_cached_release will check if the cached release in tag_dir was completely extracted. The marker file is
+        written after the archive was verified and before the tree is renamed into the cache.
+        :param tag_dir: The directory of the cached release.
+        :type tag_dir: str
+        :return: True if the cached release is complete.
+        :rtype: bool
+        """
+        return os.path.isfile(os.path.join(tag_dir, release_marker))
+
+    def set_taskfile_dir(self, tag_dir: str):
+        """
+        set_taskfile_dir will copy the cached release into the temporary directory of this run and use the copy as
+        taskfile_dir. Tasks run in taskfile_dir and write to it (.task/ and their own files), which must not change the
+        cached release.
+        :param tag_dir: The directory of the cached release.
+        :type tag_dir: str
+        """
+        global logger
+        work_dir = os.path.join(self.tmp_dir, os.path.basename(tag_dir))
+        logger.debug(f'TaskRunner: Copying the cached release "{tag_dir}" to "{work_dir}"')
+        shutil.copytree(tag_dir, work_dir, ignore=shutil.ignore_patterns(release_marker), dirs_exist_ok=True)
+        self.taskfile_dir = work_dir
+
+    def get_cached_repo_dir(self, tag_name: str) -> str:
+        """
+        get_cached_repo_dir will return the directory in cache_dir for the extracted release with the given tag.
+        :param tag_name: The release tag.
+        :type tag_name: str
+        :return: Full path to the directory of the extracted release.
+        :rtype: str
+        """
+        global cache_dir
+        if not tag_name:
+            logger.error(f'TaskRunner: The release tag for "{self.location}" is empty')
+            raise ValueError(f'The release tag for "{self.location}" is empty', 'tag_name')
+        # Tags are used as directory names. Replace anything that is not safe in a path.
+        tag_name = re.sub(r'[^A-Za-z0-9._-]', '_', tag_name).lstrip('.')
+        return os.path.join(cache_dir, 'repos', self.location.replace('/', '__'), tag_name)
+
+    def remove_old_releases(self, tag_dir: str):
+        """
+        remove_old_releases will remove the cached releases of the repo other than the given tag and the most recently
+        used tag before it. The previous tag is kept because another run may still be using it. Staging directories left
+        behind by runs that were killed are removed after an hour.
+        :param tag_dir: The directory of the current release.
+        :type tag_dir: str
+        """
+        global logger
+        repo_dir = os.path.dirname(tag_dir)
+        releases = []
+        for entry in os.scandir(repo_dir):
+            if entry.path == tag_dir or not entry.is_dir(follow_symlinks=False):
+                continue
+            if entry.name.startswith('.stage-'):
+                if time.time() - entry.stat().st_mtime > 3600:
+                    shutil.rmtree(entry.path, ignore_errors=True)
+                continue
+            releases.append((entry.stat().st_mtime, entry.path))
+
+        # Keep the most recently used release.
+        for (_, release_dir) in sorted(releases, reverse=True)[1:]:
+            logger.debug(f'TaskRunner: Removing old cached release "{release_dir}"')
+            shutil.rmtree(release_dir, ignore_errors=True)
 
     def run_task(self, task_name: str, task_args=None) -> str:
         """
@@ -442,11 +828,12 @@ class TaskRunner:
                              'task_name')
 
         try:
-            os.chdir(self.taskfile_dir)
             exe_ext = get_exe_ext()
             task_bin = os.path.join(bin_dir, f'task{exe_ext}')
             # TASKFILE_BIN_DIR is used as BIN_DIR in NiceGuyIT/Taskfiles
-            os.environ['TASKFILE_BIN_DIR'] = bin_dir
+            # The directory and environment are passed to the task instead of changing the ones of this process, since
+            # tasks run at the same time as the other bootstrap steps.
+            env = {**os.environ, 'TASKFILE_BIN_DIR': bin_dir}
 
             args = set()
             if task_args is not None:
@@ -455,7 +842,7 @@ class TaskRunner:
                 task_bin, '--verbose', task_name, *args
             ]
             logger.info(f'TaskRunner: Executing task "{task_name}" with command "{command}"')
-            output = subprocess.check_output(command, universal_newlines=True)
+            output = subprocess.check_output(command, cwd=self.taskfile_dir, env=env, universal_newlines=True)
             logger.info(f'TaskRunner: Output from task "{task_name}":')
             print(output)
             return output
@@ -486,25 +873,22 @@ def download_task():
         'asset_compress_ext': get_compress_ext(),
     })
 
-    archive_file = github_repo.download_latest(tmp_dir)
-    logger.debug(f'archive_file: {archive_file}')
-    logger.debug(f'github_repo.json_asset_name: {github_repo.json_asset_name}')
-
-    # Extract the latest release for task
+    # Find the asset to get the directory name
+    github_repo.get_latest_json()
+    github_repo.get_download_url()
     if os_name == 'linux' or os_name == 'darwin':
         (archive_name, _) = os.path.splitext(github_repo.json_asset_name)
         (asset_dir, _) = os.path.splitext(archive_name)
-        asset_dir = os.path.join(tmp_dir, asset_dir)
-        decompress = Decompress(archive_file)
-        decompress.extract_to(asset_dir)
     elif os_name == 'windows':
         (asset_dir, _) = os.path.splitext(github_repo.json_asset_name)
-        asset_dir = os.path.join(tmp_dir, asset_dir)
-        decompress = Decompress(archive_file)
-        decompress.extract_to(tmp_dir)
     else:
         logger.error(f'Unsupported OS: "{os_name}"')
         raise ValueError(f'Unsupported OS: "{os_name}"', 'os_name')
+    asset_dir = os.path.join(tmp_dir, asset_dir)
+
+    # Extract the latest release for task. Only the binary is extracted.
+    github_repo.extract_latest(asset_dir, [f'task{exe_ext}'])
+    logger.debug(f'github_repo.json_asset_name: {github_repo.json_asset_name}')
 
     asset_exe = os.path.join(asset_dir, f'task{exe_ext}')
     logger.debug(f'asset_exe: {asset_exe}')
@@ -634,6 +1018,30 @@ def set_bin_dir():
             bin_dir = os.path.normpath(tmp_dir)
 
 
+def set_cache_dir():
+    """
+    set_cache_dir will set the cache directory used to store the GitHub release metadata. The env variable
+    RUNNER_CACHE_DIR will be used if defined.
+    """
+    global cache_dir, tmp_dir
+    cache_dir = ''
+    if "RUNNER_CACHE_DIR" in os.environ:
+        cache_dir = os.path.normpath(os.getenv('RUNNER_CACHE_DIR'))
+    else:
+        os_name = get_os_name()
+        cache_dir_map = {
+            'linux': '/opt/task-runner/cache',
+            'darwin': '/opt/task-runner/cache',
+            'windows': 'C:/ProgramData/task-runner/cache',
+        }
+        if os_name in cache_dir_map:
+            cache_dir = os.path.normpath(cache_dir_map[os_name])
+        else:
+            # Use the tmp directory as a fallback.
+            set_tmp_dir()
+            cache_dir = os.path.normpath(os.path.join(tmp_dir, 'cache'))
+
+
 def set_tmp_dir(cleanup: bool = True):
     """
     set_tmp_dir will set the temporary directory used to store downloaded files.
@@ -651,6 +1059,28 @@ def set_tmp_dir(cleanup: bool = True):
             tmp_dir = tempfile.mkdtemp()
 
 
+def get_env_int(name: str, default: int) -> int:
+    """
+    get_env_int will return the environment variable as an integer. If the variable is not set, or is not an integer,
+    the default is returned. A bad value is logged as a warning instead of aborting the runner.
+    :param name: Name of the environment variable.
+    :type name: str
+    :param default: Value to use when the variable is not set or not valid.
+    :type default: int
+    :return: The value of the environment variable.
+    :rtype: int
+    """
+    global logger
+    value = os.getenv(name)
+    if value is None or value.strip() == '':
+        return default
+    try:
+        return int(value)
+    except ValueError:
+        logger.warning(f'{name} is not an integer: "{value}". Using the default: {default}')
+        return default
+
+
 def get_logger() -> logging.Logger:
     """
     get_logger will return a logger to the global logging instance.
@@ -667,24 +1097,83 @@ def get_logger() -> logging.Logger:
     return logger
 
 
+def run_steps(steps: dict) -> dict:
+    """
+    run_steps will run the steps of a dependency graph. A step is started as soon as the steps it depends on have
+    finished, so independent steps run at the same time. The time of every step is logged. If a step fails, no new
+    steps are started and the exception is raised after the running steps finish.
+    :param steps: Maps the step name to a tuple of the function to run, the list of step names it depends on and
+        optionally the keyword arguments for the function. A step with the function None is skipped.
+    :type steps: dict
+    :return: Maps the step name to the seconds it took.
+    :rtype: dict
+    """
+    global logger
+    import concurrent.futures
+
+    def run_step(step_func, step_kwargs: dict) -> float:
+        step_start = time.perf_counter()
+        step_func(**step_kwargs)
+        return time.perf_counter() - step_start
+
+    start = time.perf_counter()
+    timings = {}
+    pending = dict(steps)
+    running = {}
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, len(steps))) as executor:
+        while pending or running:
+            for (name, (func, depends, *kwargs)) in list(pending.items()):
+                if not all(depend in timings for depend in depends):
+                    continue
+                del pending[name]
+                if func is None:
+                    logger.debug(f'Step "{name}" is skipped')
+                    timings[name] = 0.0
+                    continue
+                logger.debug(f'Starting step "{name}"')
+                running[executor.submit(run_step, func, kwargs[0] if kwargs else {})] = name
+            if not running:
+                if pending:
+                    logger.error(f'Steps with unknown dependencies: {", ".join(pending)}')
+                    raise ValueError(f'Steps with unknown dependencies: {", ".join(pending)}', 'steps')
+                continue
+
+            (done, _) = concurrent.futures.wait(running, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                name = running.pop(future)
+                try:
+                    timings[name] = future.result()
+                except:
+                    logger.error(f'Step "{name}" failed after {time.perf_counter() - start:.2f}s')
+                    raise
+                logger.info(f'Step "{name}" finished in {timings[name]:.2f}s')
+
+    logger.info(f'Finished {len(timings)} steps in {time.perf_counter() - start:.2f}s. '
+                f'Sum of the step times: {sum(timings.values()):.2f}s')
+    return timings
+
+
 def main():
     """
     The main function is to download the task files, perform a few checks, install some binaries if necessary, and then
     run the task.
     """
-    global bin_dir, tmp_dir, logger
+    global bin_dir, cache_dir, tmp_dir, logger
 
     set_tmp_dir(False)
     set_bin_dir()
+    set_cache_dir()
     logger.debug(f'tmp_dir: {tmp_dir}')
     logger.debug(f'bin_dir: {bin_dir}')
+    logger.debug(f'cache_dir: {cache_dir}')
 
     if not os.path.isdir(bin_dir):
         # Create parent directories as well as bin_dir
         os.makedirs(bin_dir)
 
-    if not is_installed('task'):
-        download_task()
+    if not os.path.isdir(cache_dir):
+        # Create parent directories as well as cache_dir
+        os.makedirs(cache_dir)
 
     # Task Runner library
     task_library = {
@@ -726,36 +1215,25 @@ def main():
     })
     runner.set_tmp_dir()
 
-    task_dir = ''
+    # The task binary, the library and the runner taskfiles are downloaded at the same time. 'init:all' installs the
+    # necessary binaries and needs both the task binary and the library.
+    bootstrap_steps = {
+        'download task': (download_task, []),
+        'download library': (library.download_repo, []),
+        'download runner': (runner.download_repo, []),
+        'init:all': (library.run_task, ['download task', 'download library'], {'task_name': 'init:all'}),
+    }
+    if is_installed('task'):
+        bootstrap_steps['download task'] = (None, [])
     try:
-        # Download the taskfiles and extract them to a temp directory
-        task_dir = library.download_repo()
+        run_steps(bootstrap_steps)
     except:
-        logger.error(f'Failed to download the library repository "{library.name}"')
-        raise
-
-    # TODO: Debugging only
-    # task_dir = os.path.normpath('C:/Users/dev/projects/taskfiles')
-
-    # Make sure the necessary binaries are installed
-    task_name = 'init:all'
-    try:
-        _ = library.run_task(**{
-            'task_name': task_name,
-        })
-    except subprocess.CalledProcessError as err2:
-        logger.error(f'Failed to exec task: {task_name}')
-        # logger.error(traceback.format_exc())
-        logger.error(err2)
-        # Move out of the temporary directory, so we don't prevent it from being deleted.
-        os.chdir(bin_dir)
+        logger.error(f'Failed to bootstrap the task runner')
         raise
 
     # Task name is required
     if "RUNNER_TASK_NAME" not in os.environ:
         logger.warning(f'RUNNER_TASK_NAME env var is not set. What task should be run?')
-        # Move out of the temporary directory, so we don't prevent it from being deleted.
-        os.chdir(bin_dir)
         raise ValueError(f'RUNNER_TASK_NAME env var is not set. What task should be run?')
     task_name = os.environ['RUNNER_TASK_NAME']
 
@@ -774,13 +1252,8 @@ def main():
         logger.error(f'Failed to exec task: {task_name}')
         # logger.error(traceback.format_exc())
         logger.error(err2)
-        # Move out of the temporary directory, so we don't prevent it from being deleted.
-        os.chdir(bin_dir)
         raise ValueError(f'Failed to run task "{task_name}" with args "{task_args}"')
 
-    # Move out of the temporary directory, so we don't prevent it from being deleted.
-    os.chdir(bin_dir)
-
     return
 
 